@@ -1,12 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
-from typing import List
-from app.core.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.orm import Session, joinedload, contains_eager, with_expression, load_only
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
+from pydantic import BaseModel, ConfigDict, Field, AliasPath
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import hashlib
+from app.core.database import get_db, get_async_db
 from app.core.config import settings
-from app.api.auth import get_current_user
-from app.models.user import User
+from app.core.cache import cache
+from app.api.auth import require_role
+from app.models.user import User, Student
+from app.models.course import Course, CourseStudent
 from app.models.attendance import AttendanceSession, Attendance
+from app.utils.gps_verification import haversine_distance_expr
+from app.utils.face_recognition import (
+    decode_image, encode_face_from_base64, encoding_distance, screen_face_match, verify_face, verify_face_advanced
+)
 from app.services.attendance_service import (
     create_attendance_session,
     mark_attendance_with_verification,
@@ -15,12 +26,21 @@ from app.services.attendance_service import (
 
 router = APIRouter(prefix="/attendance", tags=["attendance"])
 
+# Rows fetched per round-trip when streaming large result sets
+STREAM_BATCH_SIZE = 200
+
+# Settings read on every face verification, resolved once at import
+FACE_RECOGNITION_TOLERANCE = settings.face_recognition_tolerance
+
+# How long a test-face outcome is reused for an identical retry
+FACE_TEST_CACHE_TTL_SECONDS = 120
+
 
 class CreateSessionRequest(BaseModel):
     title: str
     course_id: int
-    start_time: str  # ISO format datetime string
-    end_time: str    # ISO format datetime string
+    start_time: datetime
+    end_time: datetime
     location_lat: float
     location_lng: float
     location_radius: float = 100.0
@@ -37,42 +57,52 @@ class TestFaceRequest(BaseModel):
     face_image_data: str
 
 
+class SessionOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    title: str
+    course_id: int
+    course_name: str = Field(validation_alias=AliasPath("course", "name"))
+    course_code: str = Field(validation_alias=AliasPath("course", "code"))
+    created_at: datetime
+    is_active: bool
+
+
+class LecturerSessionOut(SessionOut):
+    attendance_count: int
+
+
+class AttendanceHistoryOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    session_title: str = Field(validation_alias=AliasPath("session", "title"))
+    course_name: str = Field(validation_alias=AliasPath("session", "course", "name"))
+    course_code: str = Field(validation_alias=AliasPath("session", "course", "code"))
+    marked_at: datetime
+    status: str = "present"
+
+
 @router.post("/sessions")
 def create_session(
     request: CreateSessionRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can create attendance sessions")),
     db: Session = Depends(get_db)
 ):
     """Create new attendance session (lecturer only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can create attendance sessions"
-        )
-    
-    from datetime import datetime
-    
-    try:
-        start_time = datetime.fromisoformat(request.start_time.replace('Z', '+00:00'))
-        end_time = datetime.fromisoformat(request.end_time.replace('Z', '+00:00'))
-        
-        if end_time <= start_time:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="End time must be after start time"
-            )
-    except ValueError:
+    if request.end_time <= request.start_time:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid datetime format"
+            detail="End time must be after start time"
         )
     
     session = create_attendance_session(
         db=db,
         title=request.title,
         course_id=request.course_id,
-        start_time=start_time,
-        end_time=end_time,
+        start_time=request.start_time,
+        end_time=request.end_time,
         location_lat=request.location_lat,
         location_lng=request.location_lng,
         location_radius=request.location_radius
@@ -87,238 +117,207 @@ def create_session(
 @router.post("/mark")
 def mark_attendance(
     request: MarkAttendanceRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can mark attendance")),
     db: Session = Depends(get_db)
 ):
     """Mark attendance with face and GPS verification (student only)."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can mark attendance"
-        )
-    
-    return mark_attendance_with_verification(
+    # Returned as a response so orjson serializes the result directly, numpy scores included,
+    # instead of FastAPI first walking it with jsonable_encoder
+    return ORJSONResponse(mark_attendance_with_verification(
         db=db,
         session_id=request.session_id,
         student_id=current_user.id,
         face_image_data=request.face_image_data,
         student_lat=request.student_lat,
         student_lng=request.student_lng
-    )
+    ))
 
 
-@router.get("/sessions/active")
-def get_active_sessions(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+@router.get("/sessions/active", response_model=List[SessionOut])
+async def get_active_sessions(
+    current_user: User = Depends(require_role("student", "Only students can view active sessions")),
+    db: AsyncSession = Depends(get_async_db),
+    lat: Optional[float] = Query(None, description="Only return sessions whose radius covers this latitude"),
+    lng: Optional[float] = Query(None, description="Only return sessions whose radius covers this longitude")
 ):
     """Get active attendance sessions for students."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can view active sessions"
-        )
-    
-    from app.models.course import CourseStudent, Course
-    
-    # Get courses student is enrolled in
-    enrollments = db.query(CourseStudent).filter(CourseStudent.student_id == current_user.id).all()
-    course_ids = [e.course_id for e in enrollments]
-    
-    if not course_ids:
-        return []
-    
-    # Get active sessions for enrolled courses
-    sessions = db.query(AttendanceSession).filter(
-        AttendanceSession.course_id.in_(course_ids),
+    # Get active sessions for enrolled courses together with their course in one query;
+    # enrollment is a semi-join so course ids never round-trip through Python
+    enrolled_course_ids = select(CourseStudent.course_id).where(CourseStudent.student_id == current_user.id)
+    stmt = select(AttendanceSession).join(
+        Course, Course.id == AttendanceSession.course_id
+    ).options(
+        contains_eager(AttendanceSession.course)
+    ).where(
+        AttendanceSession.course_id.in_(enrolled_course_ids),
         AttendanceSession.is_active == True
-    ).all()
-    
-    result = []
-    for session in sessions:
-        course = db.query(Course).filter(Course.id == session.course_id).first()
-        result.append({
-            "id": session.id,
-            "title": session.title,
-            "course_id": session.course_id,
-            "course_name": course.name if course else "Unknown",
-            "course_code": course.code if course else "Unknown",
-            "created_at": session.created_at,
-            "is_active": session.is_active
-        })
-    
-    return result
+    )
 
-@router.get("/sessions/lecturer")
-def get_lecturer_sessions(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    # Let the database drop sessions whose radius does not cover the student's position
+    if lat is not None and lng is not None:
+        stmt = stmt.where(
+            haversine_distance_expr(AttendanceSession.location_lat, AttendanceSession.location_lng, lat, lng)
+            <= AttendanceSession.location_radius
+        )
+
+    return (await db.execute(stmt)).scalars().all()
+
+@router.get("/sessions/lecturer", response_model=List[LecturerSessionOut])
+async def get_lecturer_sessions(
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can view their sessions")),
+    db: AsyncSession = Depends(get_async_db),
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of sessions to return"),
+    offset: int = Query(0, ge=0, description="Number of sessions to skip")
 ):
     """Get attendance sessions created by current lecturer."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can view their sessions"
-        )
-    
-    from app.models.course import Course
-    
-    # Get lecturer's courses
-    courses = db.query(Course).filter(Course.lecturer_id == current_user.id).all()
-    course_ids = [c.id for c in courses]
-    
-    if not course_ids:
-        return []
-    
-    # Get sessions for lecturer's courses
-    sessions = db.query(AttendanceSession).filter(
-        AttendanceSession.course_id.in_(course_ids)
-    ).order_by(AttendanceSession.created_at.desc()).all()
-    
-    result = []
-    for session in sessions:
-        course = db.query(Course).filter(Course.id == session.course_id).first()
-        attendance_count = db.query(Attendance).filter(Attendance.session_id == session.id).count()
-        
-        result.append({
-            "id": session.id,
-            "title": session.title,
-            "course_id": session.course_id,
-            "course_name": course.name if course else "Unknown",
-            "course_code": course.code if course else "Unknown",
-            "created_at": session.created_at,
-            "is_active": session.is_active,
-            "attendance_count": attendance_count
-        })
-    
-    return result
+    # Get sessions for lecturer's courses with their attendance counts in one query
+    stmt = select(AttendanceSession).join(
+        Course, Course.id == AttendanceSession.course_id
+    ).options(
+        contains_eager(AttendanceSession.course),
+        with_expression(AttendanceSession.attendance_count, func.count(Attendance.id))
+    ).outerjoin(
+        Attendance, Attendance.session_id == AttendanceSession.id
+    ).where(
+        Course.lecturer_id == current_user.id
+    ).group_by(
+        AttendanceSession.id, Course.id
+    ).order_by(AttendanceSession.created_at.desc()).offset(offset).limit(limit)
+    sessions = await db.stream_scalars(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+    return [session async for session in sessions]
 
 @router.get("/sessions/{session_id}/attendance")
 def get_attendance_records(
     session_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can view attendance records")),
     db: Session = Depends(get_db)
 ):
     """Get attendance records for a session (lecturer only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can view attendance records"
-        )
-    
-    return get_session_attendance(db, session_id)
+    return ORJSONResponse(get_session_attendance(db, session_id))
 
-@router.get("/student/history")
-def get_student_attendance_history(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+@router.get("/student/history", response_model=List[AttendanceHistoryOut])
+async def get_student_attendance_history(
+    current_user: User = Depends(require_role("student", "Only students can view their attendance history")),
+    db: AsyncSession = Depends(get_async_db),
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of records to return"),
+    offset: int = Query(0, ge=0, description="Number of records to skip")
 ):
     """Get attendance history for current student."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can view their attendance history"
-        )
-    
-    from app.models.course import Course
-    
-    # Get student's attendance records
-    records = db.query(Attendance).filter(Attendance.student_id == current_user.id).order_by(Attendance.marked_at.desc()).all()
-    
-    result = []
-    for record in records:
-        session = db.query(AttendanceSession).filter(AttendanceSession.id == record.session_id).first()
-        if session:
-            course = db.query(Course).filter(Course.id == session.course_id).first()
-            result.append({
-                "id": record.id,
-                "session_title": session.title,
-                "course_name": course.name if course else "Unknown",
-                "course_code": course.code if course else "Unknown",
-                "marked_at": record.marked_at,
-                "status": "present"
-            })
+    # Get student's attendance records with session and course eagerly loaded
+    stmt = select(Attendance).options(
+        joinedload(Attendance.session).joinedload(AttendanceSession.course)
+    ).where(Attendance.student_id == current_user.id).order_by(Attendance.marked_at.desc()).offset(offset).limit(limit)
+    records = await db.stream_scalars(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+    return [record async for record in records]
+
+
+def _verify_advanced(student, image, new_encoding: str) -> Dict[str, Any]:
+    """Verify against the advanced embeddings, screening with the basic encoding distance first."""
+    if student.facial_encoding:
+        distance = encoding_distance(student.facial_encoding, new_encoding)
+        screened_match = screen_face_match(distance, FACE_RECOGNITION_TOLERANCE)
+        if screened_match is not None:
+            return {'match': screened_match, 'details': {'method': 'basic_screen', 'distance': round(distance, 4)}}
     
-    return result
+    try:
+        verification_result = verify_face_advanced(
+            student.advanced_facial_encoding,
+            image,
+            FACE_RECOGNITION_TOLERANCE
+        )
+        return {
+            'match': bool(verification_result.get('match', False)),
+            'details': {
+                'method': 'advanced',
+                'confidence': float(verification_result.get('confidence', 0.0)),
+                'models_used': list(verification_result.get('model_results', {}).keys()),
+                'quality_score': float(verification_result.get('quality_score', 0.0))
+            }
+        }
+    except Exception as e:
+        # Fallback to basic if advanced fails
+        if student.facial_encoding:
+            match = bool(verify_face(student.facial_encoding, image, FACE_RECOGNITION_TOLERANCE))
+            return {'match': match, 'details': {'method': 'basic_fallback', 'error': str(e)}}
+        return {'match': False, 'details': {}}
+
+
+def _verify_basic(student, image, new_encoding: str) -> Dict[str, Any]:
+    """Verify against the legacy dlib encoding."""
+    match = bool(verify_face(student.facial_encoding, image, FACE_RECOGNITION_TOLERANCE))
+    return {'match': match, 'details': {'method': 'basic'}}
+
+
+# Face verifier per registration method, each returning JSON-safe {'match', 'details'}
+FACE_VERIFIERS = {
+    "advanced": _verify_advanced,
+    "basic": _verify_basic,
+}
 
 
 @router.post("/test-face")
 def test_face_recognition(
     request: MarkAttendanceRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can test face recognition")),
     db: Session = Depends(get_db)
 ):
     """Test face recognition without marking attendance."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can test face recognition"
-        )
-    
-    from app.models.user import Student
-    from app.utils.face_recognition import encode_face_from_base64, verify_face, verify_face_advanced
-    
-    student = db.query(Student).filter(Student.id == current_user.id).first()
+    # Leave the encoding columns unloaded until a verification branch needs them
+    student = db.query(Student).options(
+        load_only(Student.id, Student.face_registered, Student.face_registration_method)
+    ).filter(Student.id == current_user.id).first()
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Student profile not found"
         )
     
+    # Decode the image once and reuse it for encoding and verification
+    image = decode_image(request.face_image_data)
+    
     # Test face encoding
-    new_encoding = encode_face_from_base64(request.face_image_data)
+    new_encoding = encode_face_from_base64(image) if image is not None else None
     if not new_encoding:
         return {
             "face_detected": False,
             "message": "No face detected in image",
-            "has_registered_face": bool(student.facial_encoding or student.advanced_facial_encoding),
+            "has_registered_face": bool(student.face_registered),
             "registration_method": student.face_registration_method or "none"
         }
     
-    # Test face verification based on registration method
-    face_match = False
-    verification_details = {}
+    # A face was found, so fetch both encodings for verification in a single round-trip
+    db.refresh(student, attribute_names=["facial_encoding", "advanced_facial_encoding"])
     
+    # Test face verification based on registration method
     if student.advanced_facial_encoding and student.face_registration_method == "advanced":
-        try:
-            # Test advanced verification
-            verification_result = verify_face_advanced(
-                student.advanced_facial_encoding,
-                request.face_image_data,
-                settings.face_recognition_tolerance
-            )
-            face_match = verification_result.get('match', False)
-            verification_details = {
-                'method': 'advanced',
-                'confidence': verification_result.get('confidence', 0.0),
-                'models_used': list(verification_result.get('model_results', {}).keys()),
-                'quality_score': verification_result.get('quality_score', 0.0)
-            }
-        except Exception as e:
-            # Fallback to basic if advanced fails
-            if student.facial_encoding:
-                face_match = verify_face(
-                    student.facial_encoding,
-                    request.face_image_data,
-                    settings.face_recognition_tolerance
-                )
-                verification_details = {'method': 'basic_fallback', 'error': str(e)}
+        method = "advanced"
     elif student.facial_encoding:
-        # Test basic verification
-        face_match = verify_face(
-            student.facial_encoding,
-            request.face_image_data,
-            settings.face_recognition_tolerance
-        )
-        verification_details = {'method': 'basic'}
+        method = "basic"
+    else:
+        method = None
+    
+    verification = {'match': False, 'details': {}}
+    if method:
+        # Identical retries against the same registration reuse the previous outcome
+        digest = hashlib.sha1("\n".join([
+            request.face_image_data, student.facial_encoding or "", student.advanced_facial_encoding or ""
+        ]).encode()).hexdigest()
+        cache_key = f"face_test:{student.id}:{digest}"
+        cached = cache.get(cache_key)
+        if cached:
+            verification = cached
+        else:
+            verification = FACE_VERIFIERS[method](student, image, new_encoding)
+            if 'error' not in verification['details']:
+                cache.set(cache_key, verification, FACE_TEST_CACHE_TTL_SECONDS)
     
     return {
         "face_detected": True,
-        "has_registered_face": bool(student.facial_encoding or student.advanced_facial_encoding),
+        "has_registered_face": bool(student.face_registered),
         "registration_method": student.face_registration_method or "basic",
-        "face_match": face_match,
-        "verification_details": verification_details,
+        "face_match": verification['match'],
+        "verification_details": verification['details'],
         "message": "Face recognition test completed",
-        "tolerance": settings.face_recognition_tolerance,
+        "tolerance": FACE_RECOGNITION_TOLERANCE,
         "can_upgrade": student.face_registered and student.face_registration_method == "basic"
     }
\ No newline at end of file
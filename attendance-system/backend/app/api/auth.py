@@ -1,15 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, undefer
 from pydantic import BaseModel
+from typing import Optional
 from app.core.database import get_db
+from app.core.cache import cache, STUDENT_LISTINGS_NAMESPACE
+from app.core.config import settings
 from app.core.security import verify_token, verify_password
 from app.services.auth_service import authenticate_user, create_user_token, get_user_profile, register_student, register_lecturer
 from app.models.user import User
+import time
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 security = HTTPBearer()
 
+# Settings read on every authenticated request, resolved once at import
+USER_CACHE_TTL_SECONDS = settings.user_cache_ttl_seconds
+
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -25,6 +32,12 @@ def get_current_user(
             detail="Invalid token"
         )
     
+    # Serve the minimal user fields from cache to skip the per-request lookup
+    cache_key = f"user:{user_id}"
+    cached = cache.get(cache_key)
+    if cached:
+        return User(**cached)
+    
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(
@@ -32,9 +45,27 @@ def get_current_user(
             detail="User not found"
         )
     
+    # Never keep the entry past the token's own expiry
+    ttl = min(USER_CACHE_TTL_SECONDS, int(payload.get("exp", 0) - time.time()))
+    if ttl > 0:
+        cache.set(cache_key, {"id": user.id, "name": user.name, "role": user.role}, ttl)
+    
     return user
 
 
+def require_role(role: str, detail: Optional[str] = None):
+    """Build a dependency that returns the current user only if they have the given role."""
+    def role_checker(current_user: User = Depends(get_current_user)) -> User:
+        if current_user.role != role:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=detail or f"Only {role}s can access this endpoint"
+            )
+        return current_user
+    
+    return role_checker
+
+
 class StudentLoginRequest(BaseModel):
     matric_no: str
     password: str
@@ -113,21 +144,17 @@ def register_lecturer_endpoint(request: RegisterLecturerRequest, db: Session = D
 @router.post("/register-face")
 def register_face(
     request: RegisterFaceRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can register faces")),
     db: Session = Depends(get_db)
 ):
     """Register face encoding for student with quality validation."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can register faces"
-        )
-    
     from app.utils.face_recognition import validate_and_encode_face
     from app.models.user import Student
     
-    # Get student profile
-    student = db.query(Student).filter(Student.id == current_user.id).first()
+    # Get student profile with the existing encoding needed for the same-person check
+    student = db.query(Student).options(
+        undefer(Student.facial_encoding)
+    ).filter(Student.id == current_user.id).first()
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -171,7 +198,6 @@ def register_face(
     # If student already has a face registered, verify it's the same person
     if student.facial_encoding:
         from app.utils.face_recognition import verify_face
-        from app.core.config import settings
         
         is_same_person = verify_face(
             student.facial_encoding,
@@ -190,6 +216,10 @@ def register_face(
     student.face_registered = True
     db.commit()
     
+    from app.api.face_registration import face_status_cache_key
+    cache.delete(face_status_cache_key(student.id))
+    cache.bump_namespace(STUDENT_LISTINGS_NAMESPACE)
+    
     # Return success with quality metrics
     quality_score = validation_result.get("quality_score", 0)
     confidence = validation_result.get("confidence", 0)
@@ -235,16 +265,10 @@ def get_current_user_profile(
 @router.post("/test-face-quality")
 def test_face_quality(
     request: TestFaceQualityRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can test face quality")),
     db: Session = Depends(get_db)
 ):
     """Test face image quality before registration."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can test face quality"
-        )
-    
     from app.utils.face_recognition import validate_and_encode_face
     
     # Validate image quality without saving
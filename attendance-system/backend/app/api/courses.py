@@ -1,58 +1,104 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, case, and_, or_, exists, select, update
 from pydantic import BaseModel
-from typing import List
-from app.core.database import get_db
-from app.api.auth import get_current_user
+from typing import List, Optional
+from datetime import datetime
+from collections import defaultdict
+from app.core.database import get_db, dialect_insert, LAZY_LOAD_GUARD
+from app.core.cache import cache, STUDENT_LISTINGS_NAMESPACE
+from app.api.auth import require_role
 from app.models.user import User
-from app.models.course import Course, CourseStudent
+from app.models.course import Course, CourseStudent, CoursePermission
 from app.models.user import Student, Lecturer
-from app.models.attendance import AttendanceSession
+from app.models.attendance import AttendanceSession, Attendance
 
 router = APIRouter(prefix="/courses", tags=["courses"])
 
+# Per-user course listings change rarely, so responses are cached briefly and invalidated on writes
+COURSES_CACHE_TTL_SECONDS = 60
+ALL_COURSES_CACHE_KEY = "courses:list"
+
+
+def student_courses_cache_key(student_id: int) -> str:
+    return f"courses:student:{student_id}"
+
+
+def lecturer_courses_cache_key(lecturer_id: int) -> str:
+    return f"courses:lecturer:{lecturer_id}"
+
+
 class CreateCourseRequest(BaseModel):
     name: str
     code: str
     description: str = ""
 
-@router.get("/")
-def get_all_courses(db: Session = Depends(get_db)):
-    """Get all available courses."""
-    courses = db.query(Course).all()
+
+class CourseOut(BaseModel):
+    id: int
+    name: str
+    code: str
+    description: str = ""
+    lecturer_name: str
+    student_count: int
+    created_at: Optional[datetime] = None
+
+
+class StudentCourseOut(BaseModel):
+    id: int
+    name: str
+    code: str
+    lecturer_name: str
+
+
+class LecturerCourseOut(BaseModel):
+    id: int
+    name: str
+    code: str
+    student_count: int
+    is_owner: bool
+    created_at: Optional[datetime] = None
+
+def _load_all_courses(db: Session) -> list:
+    """Build the all-courses listing."""
+    # Load courses with their lecturer's user row, and all enrollment counts in one grouped query
+    courses = db.query(Course).options(
+        joinedload(Course.lecturer).joinedload(Lecturer.user),
+        *LAZY_LOAD_GUARD
+    ).all()
+    student_counts = dict(
+        db.query(CourseStudent.course_id, func.count(CourseStudent.student_id)).group_by(CourseStudent.course_id).all()
+    )
     result = []
     
     for course in courses:
-        lecturer = db.query(Lecturer).filter(Lecturer.id == course.lecturer_id).first()
-        lecturer_user = db.query(User).filter(User.id == lecturer.id).first() if lecturer else None
-        
-        student_count = db.query(CourseStudent).filter(CourseStudent.course_id == course.id).count()
+        lecturer_user = course.lecturer.user if course.lecturer else None
+        student_count = student_counts.get(course.id, 0)
         
         result.append({
             "id": course.id,
             "name": course.name,
             "code": course.code,
-            "description": getattr(course, 'description', ''),
             "lecturer_name": lecturer_user.name if lecturer_user else "Unknown",
             "student_count": student_count,
-            "created_at": course.created_at if hasattr(course, 'created_at') else None
+            "created_at": course.created_at
         })
     
-    return result
+    return jsonable_encoder(result)
+
+@router.get("/", response_model=List[CourseOut])
+def get_all_courses(db: Session = Depends(get_db)):
+    """Get all available courses."""
+    return cache.get_or_compute(ALL_COURSES_CACHE_KEY, lambda: _load_all_courses(db), "courses.get_all_courses")
 
 @router.post("/")
 def create_course(
     request: CreateCourseRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can create courses")),
     db: Session = Depends(get_db)
 ):
     """Create new course (lecturer only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can create courses"
-        )
-    
     # Check if course code already exists
     existing_course = db.query(Course).filter(Course.code == request.code).first()
     if existing_course:
@@ -71,70 +117,79 @@ def create_course(
     db.commit()
     db.refresh(course)
     
+    cache.delete(ALL_COURSES_CACHE_KEY, lecturer_courses_cache_key(current_user.id))
+    
     return {"message": "Course created successfully", "course_id": course.id}
 
-@router.get("/student")
+@router.get("/student", response_model=List[StudentCourseOut])
 def get_student_courses(
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can access this endpoint")),
     db: Session = Depends(get_db)
 ):
     """Get courses enrolled by current student."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can access this endpoint"
-        )
-    
-    enrollments = db.query(CourseStudent).filter(CourseStudent.student_id == current_user.id).all()
+    cache_key = student_courses_cache_key(current_user.id)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    courses = db.query(Course).join(
+        CourseStudent, CourseStudent.course_id == Course.id
+    ).options(
+        joinedload(Course.lecturer).joinedload(Lecturer.user),
+        *LAZY_LOAD_GUARD
+    ).filter(CourseStudent.student_id == current_user.id).all()
     result = []
     
-    for enrollment in enrollments:
-        course = db.query(Course).filter(Course.id == enrollment.course_id).first()
-        if course:
-            lecturer = db.query(Lecturer).filter(Lecturer.id == course.lecturer_id).first()
-            lecturer_user = db.query(User).filter(User.id == lecturer.id).first() if lecturer else None
-            
-            result.append({
-                "id": course.id,
-                "name": course.name,
-                "code": course.code,
-                "lecturer_name": lecturer_user.name if lecturer_user else "Unknown"
-            })
+    for course in courses:
+        lecturer_user = course.lecturer.user if course.lecturer else None
+        
+        result.append({
+            "id": course.id,
+            "name": course.name,
+            "code": course.code,
+            "lecturer_name": lecturer_user.name if lecturer_user else "Unknown"
+        })
     
+    cache.set(cache_key, result, COURSES_CACHE_TTL_SECONDS)
     return result
 
-@router.get("/lecturer")
+@router.get("/lecturer", response_model=List[LecturerCourseOut])
 def get_lecturer_courses(
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can access this endpoint")),
     db: Session = Depends(get_db)
 ):
     """Get courses accessible by current lecturer (owned + permitted)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can access this endpoint"
-        )
-    
-    from app.models.course import CoursePermission
-    
-    # Get owned courses
-    owned_courses = db.query(Course).filter(Course.lecturer_id == current_user.id).all()
-    
-    # Get courses with permissions
-    permissions = db.query(CoursePermission).filter(
-        CoursePermission.lecturer_id == current_user.id
-    ).all()
-    
-    permitted_course_ids = [p.course_id for p in permissions]
-    permitted_courses = db.query(Course).filter(Course.id.in_(permitted_course_ids)).all() if permitted_course_ids else []
-    
-    # Combine and deduplicate
-    all_courses = list({course.id: course for course in owned_courses + permitted_courses}.values())
+    cache_key = lecturer_courses_cache_key(current_user.id)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # Get owned and permitted courses in one query, flagging ownership in SQL
+    rows = db.query(
+        Course,
+        case((Course.lecturer_id == current_user.id, True), else_=False).label("is_owner")
+    ).outerjoin(
+        CoursePermission,
+        and_(CoursePermission.course_id == Course.id, CoursePermission.lecturer_id == current_user.id)
+    ).options(
+        *LAZY_LOAD_GUARD
+    ).filter(
+        or_(Course.lecturer_id == current_user.id, CoursePermission.lecturer_id == current_user.id)
+    ).distinct().all()
+    
+    # Count enrollments for every course in one grouped query
+    student_counts = defaultdict(int)
+    if rows:
+        count_rows = db.query(
+            CourseStudent.course_id, func.count(CourseStudent.student_id)
+        ).filter(
+            CourseStudent.course_id.in_([course.id for course, _ in rows])
+        ).group_by(CourseStudent.course_id).all()
+        student_counts.update(count_rows)
     
     result = []
-    for course in all_courses:
-        student_count = db.query(CourseStudent).filter(CourseStudent.course_id == course.id).count()
-        is_owner = course.lecturer_id == current_user.id
+    for course, is_owner in rows:
+        student_count = student_counts[course.id]
         
         result.append({
             "id": course.id,
@@ -142,24 +197,20 @@ def get_lecturer_courses(
             "code": course.code,
             "student_count": student_count,
             "is_owner": is_owner,
-            "created_at": course.created_at if hasattr(course, 'created_at') else None
+            "created_at": course.created_at
         })
     
+    result = jsonable_encoder(result)
+    cache.set(cache_key, result, COURSES_CACHE_TTL_SECONDS)
     return result
 
 @router.post("/{course_id}/enroll")
 def enroll_in_course(
     course_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can enroll in courses")),
     db: Session = Depends(get_db)
 ):
     """Enroll current student in course."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can enroll in courses"
-        )
-    
     # Check if course exists
     course = db.query(Course).filter(Course.id == course_id).first()
     if not course:
@@ -167,65 +218,64 @@ def enroll_in_course(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Course not found"
         )
+    owner_id = course.lecturer_id
     
-    # Check if already enrolled
-    existing_enrollment = db.query(CourseStudent).filter(
-        CourseStudent.course_id == course_id,
-        CourseStudent.student_id == current_user.id
-    ).first()
+    # Create enrollment atomically; no row comes back if already enrolled
+    stmt = dialect_insert(db, CourseStudent).values(
+        course_id=course_id,
+        student_id=current_user.id
+    ).on_conflict_do_nothing(
+        index_elements=["course_id", "student_id"]
+    ).returning(CourseStudent.course_id)
+    enrolled = db.execute(stmt).first()
+    if enrolled:
+        db.execute(
+            update(Student).where(Student.id == current_user.id).values(course_count=Student.course_count + 1)
+        )
+    db.commit()
     
-    if existing_enrollment:
+    if not enrolled:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Already enrolled in this course"
         )
     
-    # Create enrollment
-    enrollment = CourseStudent(
-        course_id=course_id,
-        student_id=current_user.id
+    # Enrollment changes the student's list and the student counts seen by every lecturer of the course
+    permitted_lecturer_ids = [
+        lecturer_id for (lecturer_id,) in
+        db.query(CoursePermission.lecturer_id).filter(CoursePermission.course_id == course_id).all()
+    ]
+    cache.delete(
+        ALL_COURSES_CACHE_KEY,
+        student_courses_cache_key(current_user.id),
+        *[lecturer_courses_cache_key(lecturer_id) for lecturer_id in [owner_id, *permitted_lecturer_ids]]
     )
-    
-    db.add(enrollment)
-    db.commit()
+    cache.bump_namespace(STUDENT_LISTINGS_NAMESPACE)
     
     return {"message": "Successfully enrolled in course"}
 
 def has_course_access(db: Session, course_id: int, lecturer_id: int) -> bool:
     """Check if lecturer has access to course (owns it or has permission)."""
-    from app.models.course import CoursePermission
-    
-    # Check if lecturer owns the course
-    course = db.query(Course).filter(
+    # Check ownership or permission in a single round-trip
+    owns_course = exists().where(
         Course.id == course_id,
         Course.lecturer_id == lecturer_id
-    ).first()
-    
-    if course:
-        return True
-    
-    # Check if lecturer has permission
-    permission = db.query(CoursePermission).filter(
+    )
+    has_permission = exists().where(
         CoursePermission.course_id == course_id,
         CoursePermission.lecturer_id == lecturer_id
-    ).first()
+    )
     
-    return bool(permission)
+    return bool(db.query(or_(owns_course, has_permission)).scalar())
 
 
 @router.get("/{course_id}/students")
 def get_course_students(
     course_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can view course students")),
     db: Session = Depends(get_db)
 ):
     """Get students enrolled in course (lecturer only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can view course students"
-        )
-    
     # Check if lecturer has access to this course
     if not has_course_access(db, course_id, current_user.id):
         raise HTTPException(
@@ -233,24 +283,34 @@ def get_course_students(
             detail="Course not found or access denied"
         )
     
-    enrollments = db.query(CourseStudent).filter(CourseStudent.course_id == course_id).all()
+    students = db.query(Student).join(
+        CourseStudent, CourseStudent.student_id == Student.id
+    ).options(
+        selectinload(Student.user),
+        *LAZY_LOAD_GUARD
+    ).filter(CourseStudent.course_id == course_id).all()
+    
+    # Count every student's attendance across this course's sessions in one grouped query
+    course_session_ids = select(AttendanceSession.id).where(AttendanceSession.course_id == course_id)
+    attendance_counts = dict(
+        db.query(Attendance.student_id, func.count(Attendance.id)).filter(
+            Attendance.session_id.in_(course_session_ids)
+        ).group_by(Attendance.student_id).all()
+    )
     result = []
     
-    for enrollment in enrollments:
-        student = db.query(Student).filter(Student.id == enrollment.student_id).first()
-        if student:
-            user = db.query(User).filter(User.id == student.id).first()
-            if user:
-                # Simplified attendance count to avoid join issues
-                attendance_count = 0  # TODO: Fix attendance count query
-                
-                result.append({
-                    "id": student.id,
-                    "name": user.name,
-                    "matric_no": student.matric_no,
-                    "has_facial_encoding": bool(student.facial_encoding),
-                    "attendance_count": attendance_count
-                })
+    for student in students:
+        user = student.user
+        if user:
+            attendance_count = attendance_counts.get(student.id, 0)
+            
+            result.append({
+                "id": student.id,
+                "name": user.name,
+                "matric_no": student.matric_no,
+                "has_facial_encoding": student.has_facial_encoding,
+                "attendance_count": attendance_count
+            })
     
     return result
 
@@ -263,16 +323,10 @@ class GrantPermissionRequest(BaseModel):
 def grant_course_permission(
     course_id: int,
     request: GrantPermissionRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can grant permissions")),
     db: Session = Depends(get_db)
 ):
     """Grant course access to another lecturer (course owner only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can grant permissions"
-        )
-    
     # Check if current user owns the course
     course = db.query(Course).filter(
         Course.id == course_id,
@@ -285,56 +339,56 @@ def grant_course_permission(
             detail="Course not found or you don't own this course"
         )
     
-    # Find the lecturer to grant permission to
-    target_user = db.query(User).filter(
+    # Find the lecturer to grant permission to together with any existing permission
+    row = db.query(User.id, CoursePermission.id).outerjoin(
+        CoursePermission,
+        and_(CoursePermission.lecturer_id == User.id, CoursePermission.course_id == course_id)
+    ).filter(
         User.name == request.lecturer_name,
         User.role == "lecturer"
     ).first()
     
-    if not target_user:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Lecturer not found"
         )
     
-    # Check if permission already exists
-    from app.models.course import CoursePermission
-    existing_permission = db.query(CoursePermission).filter(
-        CoursePermission.course_id == course_id,
-        CoursePermission.lecturer_id == target_user.id
-    ).first()
-    
-    if existing_permission:
+    target_user_id, existing_permission_id = row
+    if existing_permission_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Permission already granted"
         )
     
-    # Grant permission
-    permission = CoursePermission(
+    # Grant permission; the unique (course, lecturer) index turns a concurrent duplicate into a no-op
+    stmt = dialect_insert(db, CoursePermission).values(
         course_id=course_id,
-        lecturer_id=target_user.id
-    )
-    
-    db.add(permission)
+        lecturer_id=target_user_id
+    ).on_conflict_do_nothing(
+        index_elements=["course_id", "lecturer_id"]
+    ).returning(CoursePermission.id)
+    granted = db.execute(stmt).first()
     db.commit()
     
+    if not granted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Permission already granted"
+        )
+    
+    cache.delete(lecturer_courses_cache_key(target_user_id))
+    
     return {"message": f"Permission granted to {request.lecturer_name}"}
 
 
 @router.get("/{course_id}/permissions")
 def get_course_permissions(
     course_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can view permissions")),
     db: Session = Depends(get_db)
 ):
     """Get lecturers with access to course (course owner only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can view permissions"
-        )
-    
     # Check if current user owns the course
     course = db.query(Course).filter(
         Course.id == course_id,
@@ -347,14 +401,16 @@ def get_course_permissions(
             detail="Course not found or you don't own this course"
         )
     
-    from app.models.course import CoursePermission
-    permissions = db.query(CoursePermission).filter(
+    permissions = db.query(CoursePermission).options(
+        selectinload(CoursePermission.lecturer).selectinload(Lecturer.user),
+        *LAZY_LOAD_GUARD
+    ).filter(
         CoursePermission.course_id == course_id
     ).all()
     
     result = []
     for permission in permissions:
-        lecturer_user = db.query(User).filter(User.id == permission.lecturer_id).first()
+        lecturer_user = permission.lecturer.user if permission.lecturer else None
         if lecturer_user:
             result.append({
                 "id": permission.id,
@@ -3,19 +3,50 @@ Advanced Face Registration API
 Handles face registration using multiple state-of-the-art models
 """
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import update, or_
 from pydantic import BaseModel
-from app.core.database import get_db
-from app.api.auth import get_current_user
+from app.core.database import get_db, LAZY_LOAD_GUARD
+from app.core.cache import cache, STUDENT_LISTINGS_NAMESPACE
+from app.api.auth import require_role
 from app.models.user import User, Student
-from app.utils.face_recognition import validate_and_encode_face_advanced, validate_and_encode_face
+from app.utils.face_recognition import validate_and_encode_face_advanced, validate_and_encode_face, decode_image
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+import hashlib
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Bounded pool for the CPU-heavy face analyzers so concurrent requests cannot oversubscribe the CPU
+FACE_ANALYSIS_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="face-analysis")
+
+# How long analysis of an exact image is reused when a student re-submits it
+FACE_ANALYSIS_CACHE_TTL_SECONDS = 300
+
 router = APIRouter(prefix="/face", tags=["face-registration"])
 
 
+def face_status_cache_key(student_id: int) -> str:
+    return f"face:status:{student_id}"
+
+
+def image_digest(image_data: str) -> str:
+    return hashlib.sha256(image_data.encode()).hexdigest()
+
+
+def extract_face(validator, method: str, image_data: str, student_id: int) -> dict:
+    """Run a registration validator, reusing the result for an identical image from the same student."""
+    cache_key = f"face:extract:{student_id}:{method}:{image_digest(image_data)}"
+    result = cache.get(cache_key)
+    if result is None:
+        result = validator(image_data)
+        cache.set(cache_key, result, FACE_ANALYSIS_CACHE_TTL_SECONDS)
+    return result
+
+
 class FaceRegistrationRequest(BaseModel):
     face_image_data: str
     use_advanced: bool = True
@@ -28,17 +59,11 @@ class FaceTestRequest(BaseModel):
 @router.post("/register")
 def register_face(
     request: FaceRegistrationRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can register faces")),
     db: Session = Depends(get_db)
 ):
     """Register student's face using advanced multi-model approach."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can register faces"
-        )
-    
-    student = db.query(Student).filter(Student.id == current_user.id).first()
+    student = db.query(Student).options(load_only(Student.id)).filter(Student.id == current_user.id).first()
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -48,7 +73,7 @@ def register_face(
     try:
         if request.use_advanced:
             # Use advanced multi-model face registration
-            result = validate_and_encode_face_advanced(request.face_image_data)
+            result = extract_face(validate_and_encode_face_advanced, "advanced", request.face_image_data, student.id)
             
             if not result["success"]:
                 return {
@@ -59,12 +84,14 @@ def register_face(
                 }
             
             # Store advanced encoding
-            student.advanced_facial_encoding = result.get("advanced_encoding")
-            student.face_registration_method = "advanced"
+            values = {
+                "advanced_facial_encoding": result.get("advanced_encoding"),
+                "face_registration_method": "advanced"
+            }
             
             # Also store legacy encoding for backward compatibility
             if "encoding" in result:
-                student.facial_encoding = result["encoding"]
+                values["facial_encoding"] = result["encoding"]
             
             success_message = f"Face registered successfully using {len(result.get('models_used', []))} models"
             models_info = {
@@ -74,7 +101,7 @@ def register_face(
             }
         else:
             # Use basic face registration
-            result = validate_and_encode_face(request.face_image_data)
+            result = extract_face(validate_and_encode_face, "basic", request.face_image_data, student.id)
             
             if not result["success"]:
                 return {
@@ -84,8 +111,10 @@ def register_face(
                     "error_details": result.get("error_details", {})
                 }
             
-            student.facial_encoding = result["encoding"]
-            student.face_registration_method = "basic"
+            values = {
+                "facial_encoding": result["encoding"],
+                "face_registration_method": "basic"
+            }
             
             success_message = "Face registered successfully using basic method"
             models_info = {
@@ -93,13 +122,16 @@ def register_face(
                 "confidence": result.get("confidence", 0.0)
             }
         
-        student.face_registered = True
+        # Write every registration column in a single UPDATE
+        db.execute(update(Student).where(Student.id == student.id).values(face_registered=True, **values))
         db.commit()
+        cache.delete(face_status_cache_key(student.id))
+        cache.bump_namespace(STUDENT_LISTINGS_NAMESPACE)
         
         return {
             "success": True,
             "message": success_message,
-            "registration_method": student.face_registration_method,
+            "registration_method": values["face_registration_method"],
             **models_info
         }
         
@@ -113,26 +145,32 @@ def register_face(
 
 
 @router.post("/test")
-def test_face_quality(
+async def test_face_quality(
     request: FaceTestRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can test face quality")),
     db: Session = Depends(get_db)
 ):
     """Test face image quality without registering."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can test face quality"
-        )
+    # The analysis depends only on the image, so exact re-submissions reuse it
+    cache_key = f"face:test:{image_digest(request.face_image_data)}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
     
     try:
-        # Test with advanced method
-        advanced_result = validate_and_encode_face_advanced(request.face_image_data, test_only=True)
+        # Decode once and share the image between both analyzers; undecodable data is
+        # passed through so each analyzer reports its own error
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(FACE_ANALYSIS_EXECUTOR, decode_image, request.face_image_data)
+        image_input = image if image is not None else request.face_image_data
         
-        # Test with basic method for comparison
-        basic_result = validate_and_encode_face(request.face_image_data, test_only=True)
+        # Test with advanced method, and with basic method for comparison, concurrently
+        advanced_result, basic_result = await asyncio.gather(
+            loop.run_in_executor(FACE_ANALYSIS_EXECUTOR, partial(validate_and_encode_face_advanced, image_input, test_only=True)),
+            loop.run_in_executor(FACE_ANALYSIS_EXECUTOR, partial(validate_and_encode_face, image_input, test_only=True))
+        )
         
-        return {
+        response = {
             "advanced_analysis": {
                 "success": advanced_result["success"],
                 "quality_score": advanced_result.get("quality_score", 0.0),
@@ -150,6 +188,8 @@ def test_face_quality(
             },
             "recommendation": "advanced" if advanced_result["success"] else "basic" if basic_result["success"] else "retake"
         }
+        cache.set(cache_key, response, FACE_ANALYSIS_CACHE_TTL_SECONDS)
+        return response
         
     except Exception as e:
         logger.error(f"Face quality test error: {e}")
@@ -161,46 +201,41 @@ def test_face_quality(
 
 @router.get("/status")
 def get_face_registration_status(
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can check face registration status")),
     db: Session = Depends(get_db)
 ):
     """Get current face registration status."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can check face registration status"
-        )
-    
-    student = db.query(Student).filter(Student.id == current_user.id).first()
-    if not student:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Student profile not found"
-        )
+    def load_status():
+        student = db.query(Student).options(*LAZY_LOAD_GUARD).filter(Student.id == current_user.id).first()
+        if not student:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Student profile not found"
+            )
+        
+        return {
+            "face_registered": student.face_registered,
+            "registration_method": student.face_registration_method or "none",
+            "has_basic_encoding": student.has_facial_encoding,
+            "has_advanced_encoding": student.has_advanced_facial_encoding,
+            "can_upgrade": student.face_registered and student.face_registration_method == "basic"
+        }
     
-    return {
-        "face_registered": student.face_registered,
-        "registration_method": student.face_registration_method or "none",
-        "has_basic_encoding": bool(student.facial_encoding),
-        "has_advanced_encoding": bool(student.advanced_facial_encoding),
-        "can_upgrade": student.face_registered and student.face_registration_method == "basic"
-    }
+    return cache.get_or_compute(
+        face_status_cache_key(current_user.id), load_status, "face_registration.get_face_registration_status"
+    )
 
 
 @router.post("/upgrade")
 def upgrade_to_advanced_registration(
     request: FaceRegistrationRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can upgrade face registration")),
     db: Session = Depends(get_db)
 ):
     """Upgrade existing basic face registration to advanced multi-model registration."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can upgrade face registration"
-        )
-    
-    student = db.query(Student).filter(Student.id == current_user.id).first()
+    student = db.query(Student).options(
+        load_only(Student.id, Student.face_registered, Student.face_registration_method)
+    ).filter(Student.id == current_user.id).first()
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -221,7 +256,7 @@ def upgrade_to_advanced_registration(
     
     try:
         # Perform advanced face registration
-        result = validate_and_encode_face_advanced(request.face_image_data)
+        result = extract_face(validate_and_encode_face_advanced, "advanced", request.face_image_data, student.id)
         
         if not result["success"]:
             return {
@@ -232,14 +267,34 @@ def upgrade_to_advanced_registration(
             }
         
         # Update to advanced encoding
-        student.advanced_facial_encoding = result.get("advanced_encoding")
-        student.face_registration_method = "advanced"
+        values = {
+            "advanced_facial_encoding": result.get("advanced_encoding"),
+            "face_registration_method": "advanced"
+        }
         
         # Keep legacy encoding for backward compatibility
         if "encoding" in result:
-            student.facial_encoding = result["encoding"]
+            values["facial_encoding"] = result["encoding"]
         
+        # Re-check the preconditions in the UPDATE itself so a concurrent
+        # register/unregister/upgrade cannot be overwritten
+        upgraded = db.execute(
+            update(Student).where(
+                Student.id == student.id,
+                Student.face_registered == True,
+                or_(Student.face_registration_method.is_(None), Student.face_registration_method != "advanced")
+            ).values(**values)
+        ).rowcount
         db.commit()
+        cache.delete(face_status_cache_key(student.id))
+        cache.bump_namespace(STUDENT_LISTINGS_NAMESPACE)
+        
+        if not upgraded:
+            return {
+                "success": False,
+                "error": "registration_changed",
+                "message": "Face registration changed during the upgrade, please check your status and retry"
+            }
         
         return {
             "success": True,
@@ -260,16 +315,10 @@ def upgrade_to_advanced_registration(
 
 @router.delete("/unregister")
 def unregister_face(
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_role("student", "Only students can unregister faces")),
     db: Session = Depends(get_db)
 ):
     """Remove face registration."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can unregister faces"
-        )
-    
     student = db.query(Student).filter(Student.id == current_user.id).first()
     if not student:
         raise HTTPException(
@@ -290,6 +339,8 @@ def unregister_face(
         student.face_registration_method = None
         
         db.commit()
+        cache.delete(face_status_cache_key(student.id))
+        cache.bump_namespace(STUDENT_LISTINGS_NAMESPACE)
         
         return {
             "success": True,
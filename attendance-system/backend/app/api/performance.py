@@ -1,12 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from fastapi.encoders import jsonable_encoder
 from app.core.database import get_db
-from app.services.performance_metrics import PerformanceMetrics
+from app.core.cache import cache
+from app.services.performance_metrics import metrics_service, performance_cache_key
 from typing import Optional
 
 router = APIRouter()
 
 
+def cached_section(report: str, route: str, calculate, db: Session, session_id: Optional[int]):
+    """Return one cached report section, calculating it on a miss"""
+    return cache.get_or_compute(
+        performance_cache_key(report, session_id),
+        lambda: jsonable_encoder(calculate(db, session_id)),
+        route
+    )
+
+
+# Sections of the comprehensive report as (key, cached report, cache route, calculation); the report
+# reuses each section's cache entry so a dashboard polling several endpoints aggregates once
+REPORT_SECTIONS = (
+    ("biometric_metrics", "biometric", "performance.get_biometric_metrics", metrics_service.calculate_biometric_metrics),
+    ("system_efficiency", "efficiency", "performance.get_system_efficiency", metrics_service.calculate_system_efficiency),
+    ("security_analysis", "security", "performance.get_security_analysis", metrics_service.get_security_analysis),
+)
+
+
 @router.get("/metrics")
 def get_performance_metrics(
     session_id: Optional[int] = None,
@@ -14,9 +34,14 @@ def get_performance_metrics(
 ):
     """Get comprehensive performance metrics for the attendance system"""
     try:
-        metrics_service = PerformanceMetrics(db)
-        report = metrics_service.generate_performance_report(session_id)
-        return report
+        return cache.get_or_compute(
+            performance_cache_key("metrics", session_id),
+            lambda: {
+                key: cached_section(report, route, calculate, db, session_id)
+                for key, report, route, calculate in REPORT_SECTIONS
+            },
+            "performance.get_performance_metrics"
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -28,8 +53,7 @@ def get_biometric_metrics(
 ):
     """Get biometric performance metrics (FAR, FRR, EER)"""
     try:
-        metrics_service = PerformanceMetrics(db)
-        return metrics_service.calculate_biometric_metrics(session_id)
+        return cached_section("biometric", "performance.get_biometric_metrics", metrics_service.calculate_biometric_metrics, db, session_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -41,8 +65,7 @@ def get_system_efficiency(
 ):
     """Get system efficiency metrics (GPS accuracy, latency)"""
     try:
-        metrics_service = PerformanceMetrics(db)
-        return metrics_service.calculate_system_efficiency(session_id)
+        return cached_section("efficiency", "performance.get_system_efficiency", metrics_service.calculate_system_efficiency, db, session_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -54,7 +77,6 @@ def get_security_analysis(
 ):
     """Get security robustness analysis"""
     try:
-        metrics_service = PerformanceMetrics(db)
-        return metrics_service.get_security_analysis(session_id)
+        return cached_section("security", "performance.get_security_analysis", metrics_service.get_security_analysis, db, session_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
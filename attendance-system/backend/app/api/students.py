@@ -1,38 +1,187 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.orm import joinedload, contains_eager, load_only
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, or_, select, lambda_stmt
 from pydantic import BaseModel
 from typing import List, Optional
-from app.core.database import get_db
-from app.api.auth import get_current_user
+from datetime import datetime
+from collections import defaultdict
+import orjson
+from app.core.database import get_async_db, AsyncSessionLocal, LAZY_LOAD_GUARD
+from app.core.cache import cache, STUDENT_LISTINGS_NAMESPACE
+from app.api.auth import require_role
 from app.models.user import User, Student
 from app.models.course import Course, CourseStudent
-from app.models.attendance import Attendance
+from app.models.attendance import AttendanceSession, Attendance
 
 router = APIRouter(prefix="/students", tags=["students"])
 
+# Rosters change rarely, so listings are cached briefly per lecturer and invalidated on writes
+STUDENTS_CACHE_TTL_SECONDS = 60
 
-@router.get("/")
-def get_all_students(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+# Students fetched and serialized per round-trip when streaming the full listing
+STUDENT_STREAM_BATCH_SIZE = 500
+
+# Largest page a client may request from the student listing
+MAX_STUDENT_PAGE_SIZE = 500
+
+# Student columns read by the listings; everything else stays unfetched
+LISTED_STUDENT_FIELDS = (
+    Student.matric_no,
+    Student.department,
+    Student.level,
+    Student.face_registered,
+    Student.has_facial_encoding,
+)
+
+
+def students_cache_key(*parts) -> str:
+    version = cache.namespace_version(STUDENT_LISTINGS_NAMESPACE)
+    return ":".join([STUDENT_LISTINGS_NAMESPACE, str(version), *map(str, parts)])
+
+
+class StudentOut(BaseModel):
+    id: int
+    name: str
+    matric_no: str
+    department: Optional[str] = None
+    level: Optional[str] = None
+    has_facial_encoding: bool
+    face_registered: Optional[bool] = None
+    course_count: int
+    attendance_count: int
+    created_at: Optional[datetime] = None
+    is_active: Optional[bool] = None
+
+
+class StudentProfileOut(BaseModel):
+    id: int
+    name: str
+    matric_no: str
+    department: Optional[str] = None
+    level: Optional[str] = None
+    has_facial_encoding: bool
+    face_registered: Optional[bool] = None
+    course_count: int
+    attendance_count: int
+
+
+class EnrolledStudentOut(BaseModel):
+    id: int
+    name: str
+    matric_no: str
+    department: Optional[str] = None
+    level: Optional[str] = None
+    has_facial_encoding: bool
+    face_registered: Optional[bool] = None
+    attendance_count: int
+    enrolled_at: Optional[datetime] = None
+
+
+class EnrolledCourseOut(BaseModel):
+    id: int
+    name: str
+    code: str
+    attendance_count: int
+
+
+class StudentDetailsOut(BaseModel):
+    id: int
+    name: str
+    matric_no: str
+    department: Optional[str] = None
+    level: Optional[str] = None
+    has_facial_encoding: bool
+    face_registered: Optional[bool] = None
+    enrolled_courses: List[EnrolledCourseOut]
+    total_attendance_records: int
+    created_at: Optional[datetime] = None
+    is_active: Optional[bool] = None
+
+
+def encode_students(students) -> bytes:
+    """Serialize students with their enrollment and attendance counts as comma-joined JSON objects."""
+    if not students:
+        return b""
+    
+    result = []
+    for student in students:
+        user = student.user
+        
+        result.append({
+            "id": student.id,
+            "name": user.name,
+            "matric_no": student.matric_no,
+            "department": student.department,
+            "level": student.level,
+            "has_facial_encoding": student.has_facial_encoding,
+            "face_registered": student.face_registered,
+            "course_count": student.course_count,
+            "attendance_count": student.attendance_count,
+            "created_at": user.created_at,
+            "is_active": user.is_active
+        })
+    
+    # Drop the enclosing brackets so batches can be joined into one array
+    return orjson.dumps(result)[1:-1]
+
+
+async def stream_students(stmt, cache_key: str):
+    """Yield the student listing as a JSON array one batch at a time, caching the body once complete."""
+    chunks = [b"["]
+    yield chunks[0]
+    
+    # The response outlives request-scoped dependencies, so the stream owns its session
+    async with AsyncSessionLocal() as db:
+        students = await db.stream_scalars(stmt, execution_options={"yield_per": STUDENT_STREAM_BATCH_SIZE})
+        async for batch in students.partitions():
+            chunk = encode_students(batch)
+            if len(chunks) > 1:
+                chunk = b"," + chunk
+            chunks.append(chunk)
+            yield chunk
+    
+    chunks.append(b"]")
+    yield chunks[-1]
+    cache.set(cache_key, {"body": b"".join(chunks).decode(), "next_cursor": None}, STUDENTS_CACHE_TTL_SECONDS)
+
+
+def student_page_response(body: str, next_cursor: Optional[int]) -> Response:
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/", response_model=List[StudentOut])
+async def get_all_students(
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can view all students")),
     search: Optional[str] = Query(None, description="Search by name, email, or matric number"),
     department: Optional[str] = Query(None, description="Filter by department"),
-    level: Optional[str] = Query(None, description="Filter by level")
+    level: Optional[str] = Query(None, description="Filter by level"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_STUDENT_PAGE_SIZE, description="Maximum number of students to return"),
+    cursor: Optional[int] = Query(None, ge=0, description="Return students after this id (from X-Next-Cursor)"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all students with filtering and search (lecturer only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can view all students"
-        )
+    cache_key = students_cache_key("list", current_user.id, search, department, level, limit, cursor)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return student_page_response(cached["body"], cached["next_cursor"])
     
-    query = db.query(Student).join(User)
+    # Load students with their user row in a single statement, selecting only the listed fields;
+    # built as lambdas so each combination of filters is compiled once and reused
+    stmt = lambda_stmt(lambda: select(Student).join(
+        User, User.id == Student.id
+    ).options(
+        load_only(*LISTED_STUDENT_FIELDS, Student.course_count, Student.attendance_count),
+        contains_eager(Student.user).load_only(User.name, User.created_at, User.is_active),
+        *LAZY_LOAD_GUARD
+    ))
     
     # Apply search filter
     if search:
         search_term = f"%{search}%"
-        query = query.filter(
+        stmt += lambda s: s.where(
             or_(
                 User.name.ilike(search_term),
                 Student.matric_no.ilike(search_term)
@@ -41,173 +190,176 @@ def get_all_students(
     
     # Apply department filter
     if department:
-        query = query.filter(Student.department.ilike(f"%{department}%"))
+        department_term = f"%{department}%"
+        stmt += lambda s: s.where(Student.department.ilike(department_term))
     
     # Apply level filter
     if level:
-        query = query.filter(Student.level == level)
+        stmt += lambda s: s.where(Student.level == level)
     
-    students = query.all()
-    result = []
+    # Keyset pagination: resume after the last id of the previous page instead of OFFSET
+    if cursor is not None:
+        stmt += lambda s: s.where(Student.id > cursor)
+    stmt += lambda s: s.order_by(Student.id)
     
-    for student in students:
-        user = db.query(User).filter(User.id == student.id).first()
-        if user:
-            course_count = db.query(CourseStudent).filter(CourseStudent.student_id == student.id).count()
-            attendance_count = db.query(Attendance).filter(Attendance.student_id == student.id).count()
-            
-            result.append({
-                "id": student.id,
-                "name": user.name,
-                "matric_no": student.matric_no,
-                "department": student.department,
-                "level": student.level,
-                "has_facial_encoding": bool(student.facial_encoding),
-                "face_registered": student.face_registered,
-                "course_count": course_count,
-                "attendance_count": attendance_count,
-                "created_at": user.created_at,
-                "is_active": user.is_active
-            })
+    # Without a limit the full listing is streamed
+    if limit is None:
+        return StreamingResponse(stream_students(stmt, cache_key), media_type="application/json")
     
-    return result
+    stmt += lambda s: s.limit(limit)
+    students = (await db.execute(stmt)).scalars().all()
+    body = (b"[" + encode_students(students) + b"]").decode()
+    next_cursor = students[-1].id if len(students) == limit else None
+    cache.set(cache_key, {"body": body, "next_cursor": next_cursor}, STUDENTS_CACHE_TTL_SECONDS)
+    return student_page_response(body, next_cursor)
 
 
-@router.get("/profile")
-def get_student_profile(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+@router.get("/profile", response_model=StudentProfileOut)
+async def get_student_profile(
+    current_user: User = Depends(require_role("student", "Only students can access this endpoint")),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current student's profile."""
-    if current_user.role != "student":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only students can access this endpoint"
-        )
-    
-    student = db.query(Student).filter(Student.id == current_user.id).first()
+    stmt = select(Student).options(*LAZY_LOAD_GUARD).where(Student.id == current_user.id)
+    student = await db.scalar(stmt)
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Student profile not found"
         )
     
-    course_count = db.query(CourseStudent).filter(CourseStudent.student_id == student.id).count()
-    attendance_count = db.query(Attendance).filter(Attendance.student_id == student.id).count()
-    
     return {
         "id": student.id,
         "name": current_user.name,
         "matric_no": student.matric_no,
         "department": student.department,
         "level": student.level,
-        "has_facial_encoding": bool(student.facial_encoding),
+        "has_facial_encoding": student.has_facial_encoding,
         "face_registered": student.face_registered,
-        "course_count": course_count,
-        "attendance_count": attendance_count
+        "course_count": student.course_count,
+        "attendance_count": student.attendance_count
     }
 
 
-@router.get("/course/{course_id}")
-def get_students_by_course(
+@router.get("/course/{course_id}", response_model=List[EnrolledStudentOut])
+async def get_students_by_course(
     course_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can view course students")),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get students enrolled in a specific course (lecturer only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can view course students"
-        )
+    cache_key = students_cache_key("course", course_id, current_user.id)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
     
     # Verify lecturer owns this course
-    course = db.query(Course).filter(
+    course = await db.scalar(select(Course.id).where(
         Course.id == course_id,
         Course.lecturer_id == current_user.id
-    ).first()
+    ))
     
-    if not course:
+    if course is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Course not found or access denied"
         )
     
-    enrollments = db.query(CourseStudent).filter(CourseStudent.course_id == course_id).all()
-    result = []
+    # Load enrolled students with their user names, selecting only the listed fields
+    stmt = lambda_stmt(lambda: select(Student).join(
+        CourseStudent, CourseStudent.student_id == Student.id
+    ).join(
+        User, User.id == Student.id
+    ).options(
+        load_only(*LISTED_STUDENT_FIELDS),
+        contains_eager(Student.user).load_only(User.name),
+        *LAZY_LOAD_GUARD
+    ).where(CourseStudent.course_id == course_id))
+    students = (await db.execute(stmt)).scalars().all()
+    
+    # Count attendance in this course's sessions for every student in one grouped query
+    attendance_counts = defaultdict(int)
+    attendance_counts.update((await db.execute(lambda_stmt(
+        lambda: select(Attendance.student_id, func.count(Attendance.id)).where(
+            Attendance.session_id.in_(
+                select(AttendanceSession.id).where(AttendanceSession.course_id == course_id)
+            )
+        ).group_by(Attendance.student_id)
+    ))).all())
     
-    for enrollment in enrollments:
-        student = db.query(Student).filter(Student.id == enrollment.student_id).first()
-        if student:
-            user = db.query(User).filter(User.id == student.id).first()
-            if user:
-                attendance_count = db.query(Attendance).filter(
-                    Attendance.student_id == student.id,
-                    Attendance.course_id == course_id
-                ).count()
-                
-                result.append({
-                    "id": student.id,
-                    "name": user.name,
-                    "matric_no": student.matric_no,
-                    "department": student.department,
-                    "level": student.level,
-                    "has_facial_encoding": bool(student.facial_encoding),
-                    "face_registered": student.face_registered,
-                    "attendance_count": attendance_count,
-                    "enrolled_at": enrollment.enrolled_at if hasattr(enrollment, 'enrolled_at') else None
-                })
+    result = []
+    for student in students:
+        user = student.user
+        attendance_count = attendance_counts[student.id]
+        
+        result.append({
+            "id": student.id,
+            "name": user.name,
+            "matric_no": student.matric_no,
+            "department": student.department,
+            "level": student.level,
+            "has_facial_encoding": student.has_facial_encoding,
+            "face_registered": student.face_registered,
+            "attendance_count": attendance_count,
+            "enrolled_at": None  # Enrollments do not record a timestamp
+        })
     
+    cache.set(cache_key, result, STUDENTS_CACHE_TTL_SECONDS)
     return result
 
 
-@router.get("/{student_id}/details")
-def get_student_details(
+@router.get("/{student_id}/details", response_model=StudentDetailsOut)
+async def get_student_details(
     student_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(require_role("lecturer", "Only lecturers can view student details")),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get detailed student information (lecturer only)."""
-    if current_user.role != "lecturer":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only lecturers can view student details"
-        )
-    
-    student = db.query(Student).filter(Student.id == student_id).first()
+    # Load the student and their user row in one query
+    stmt = select(Student).options(
+        joinedload(Student.user),
+        *LAZY_LOAD_GUARD
+    ).where(Student.id == student_id)
+    student = await db.scalar(stmt)
     if not student:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Student not found"
         )
     
-    user = db.query(User).filter(User.id == student.id).first()
+    user = student.user
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    # Get enrolled courses
-    enrollments = db.query(CourseStudent).filter(CourseStudent.student_id == student.id).all()
+    # Get enrolled courses with the student's attendance per course from one grouped subquery
+    course_attendance = select(
+        AttendanceSession.course_id, func.count(Attendance.id).label("attendance_count")
+    ).join(
+        Attendance, Attendance.session_id == AttendanceSession.id
+    ).where(
+        Attendance.student_id == student.id
+    ).group_by(AttendanceSession.course_id).subquery()
+    
+    stmt = select(
+        Course.id, Course.name, Course.code, func.coalesce(course_attendance.c.attendance_count, 0)
+    ).join(
+        CourseStudent, CourseStudent.course_id == Course.id
+    ).outerjoin(
+        course_attendance, course_attendance.c.course_id == Course.id
+    ).where(CourseStudent.student_id == student.id)
+    rows = (await db.execute(stmt)).all()
     enrolled_courses = []
     
-    for enrollment in enrollments:
-        course = db.query(Course).filter(Course.id == enrollment.course_id).first()
-        if course:
-            attendance_count = db.query(Attendance).filter(
-                Attendance.student_id == student.id,
-                Attendance.course_id == course.id
-            ).count()
-            
-            enrolled_courses.append({
-                "id": course.id,
-                "name": course.name,
-                "code": course.code,
-                "attendance_count": attendance_count
-            })
-    
-    total_attendance = db.query(Attendance).filter(Attendance.student_id == student.id).count()
+    for course_id, name, code, attendance_count in rows:
+        enrolled_courses.append({
+            "id": course_id,
+            "name": name,
+            "code": code,
+            "attendance_count": attendance_count
+        })
     
     return {
         "id": student.id,
@@ -215,10 +367,10 @@ def get_student_details(
         "matric_no": student.matric_no,
         "department": student.department,
         "level": student.level,
-        "has_facial_encoding": bool(student.facial_encoding),
+        "has_facial_encoding": student.has_facial_encoding,
         "face_registered": student.face_registered,
         "enrolled_courses": enrolled_courses,
-        "total_attendance_records": total_attendance,
+        "total_attendance_records": student.attendance_count,
         "created_at": user.created_at,
         "is_active": user.is_active
     }
\ No newline at end of file
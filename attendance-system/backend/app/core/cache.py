@@ -0,0 +1,186 @@
+"""
+Cache Module
+Shared key/value cache backed by Redis, with an in-process fallback
+"""
+import json
+import time
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+from sqlalchemy.exc import SQLAlchemyError
+from app.core.config import settings
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on entries kept by the in-process fallback
+MAX_LOCAL_ENTRIES = 10000
+
+# Cache tiers as (seconds a response is fresh, further seconds it may be served stale on DB failure)
+CACHE_TIERS = {
+    "short": (10, 60),
+    "normal": (30, 300),
+    "long": (60, 600),
+    "extended": (300, 900),
+}
+
+# Cache tier per cached route
+CACHE_POLICIES = {
+    "courses.get_all_courses": "normal",
+    "face_registration.get_face_registration_status": "long",
+    "performance.get_performance_metrics": "extended",
+    "performance.get_biometric_metrics": "extended",
+    "performance.get_system_efficiency": "extended",
+    "performance.get_security_analysis": "extended",
+}
+
+# How long a namespace generation is remembered; must outlive every entry keyed under it
+NAMESPACE_VERSION_TTL_SECONDS = 86400
+
+# Namespace of the cached student rosters, bumped on student, enrollment, face and attendance writes
+STUDENT_LISTINGS_NAMESPACE = "students"
+
+# False-positive rate of Redis Bloom filters; a false positive only costs the exact database check
+BLOOM_ERROR_RATE = 0.001
+
+
+class Cache:
+    """JSON value cache using Redis when configured, otherwise a local TTL dictionary"""
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self.client = None
+        self._local: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+        if redis_url and REDIS_AVAILABLE:
+            try:
+                self.client = redis.Redis.from_url(redis_url, decode_responses=True)
+                self.client.ping()
+                logger.info("Redis cache initialized")
+            except Exception as e:
+                logger.warning(f"Failed to connect to Redis, using in-process cache: {e}")
+                self.client = None
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss"""
+        try:
+            if self.client is not None:
+                raw = self.client.get(key)
+            else:
+                with self._lock:
+                    entry = self._local.get(key)
+                    if entry and entry[0] < time.monotonic():
+                        del self._local[key]
+                        entry = None
+                raw = entry[1] if entry else None
+            return json.loads(raw) if raw is not None else None
+        except Exception as e:
+            logger.warning(f"Cache get error for {key}: {e}")
+            return None
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        """Store a JSON-serializable value for ttl seconds"""
+        try:
+            raw = json.dumps(value, default=str)
+            if self.client is not None:
+                self.client.setex(key, ttl, raw)
+            else:
+                with self._lock:
+                    if len(self._local) >= MAX_LOCAL_ENTRIES:
+                        self._evict_local()
+                    self._local[key] = (time.monotonic() + ttl, raw)
+        except Exception as e:
+            logger.warning(f"Cache set error for {key}: {e}")
+
+    def delete(self, *keys: str) -> None:
+        """Remove keys from the cache"""
+        if not keys:
+            return
+        try:
+            if self.client is not None:
+                self.client.delete(*keys)
+            else:
+                with self._lock:
+                    for key in keys:
+                        self._local.pop(key, None)
+        except Exception as e:
+            logger.warning(f"Cache delete error for {keys}: {e}")
+
+    def namespace_version(self, namespace: str) -> int:
+        """Return the current generation of a key namespace, to be embedded in its keys"""
+        return self.get(f"{namespace}:version") or 0
+
+    def bump_namespace(self, namespace: str) -> None:
+        """Invalidate every key built from the namespace's current generation"""
+        self.set(f"{namespace}:version", time.time_ns(), NAMESPACE_VERSION_TTL_SECONDS)
+
+    def bloom_reserve(self, key: str, capacity: int, ttl: int) -> None:
+        """Create a Redis Bloom filter for key, sized for capacity items and expiring after ttl seconds"""
+        if self.client is None:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.execute_command("BF.RESERVE", key, BLOOM_ERROR_RATE, max(capacity, 1))
+            pipe.expire(key, ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Bloom reserve error for {key}: {e}")
+
+    def bloom_add(self, key: str, item: Any) -> None:
+        """Add item to the Bloom filter at key; never creates a filter that was not reserved"""
+        if self.client is None:
+            return
+        try:
+            self.client.execute_command("BF.INSERT", key, "NOCREATE", "ITEMS", item)
+        except Exception as e:
+            logger.warning(f"Bloom add error for {key}: {e}")
+
+    def bloom_might_contain(self, key: str, item: Any) -> bool:
+        """Return False only when the Bloom filter at key definitely does not hold item"""
+        if self.client is None:
+            return True
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.exists(key)
+            pipe.execute_command("BF.EXISTS", key, item)
+            reserved, present = pipe.execute()
+            return not reserved or bool(present)
+        except Exception as e:
+            logger.warning(f"Bloom lookup error for {key}: {e}")
+            return True
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], route: str) -> Any:
+        """Return a fresh cached value or recompute it, serving stale data if the database fails"""
+        fresh_seconds, fallback_seconds = CACHE_TIERS[CACHE_POLICIES[route]]
+        entry = self.get(key)
+        now = time.time()
+        if entry and now < entry["stale_at"]:
+            return entry["body"]
+        
+        try:
+            body = compute()
+        except SQLAlchemyError as e:
+            if entry and now < entry["generated_at"] + fresh_seconds + fallback_seconds:
+                logger.warning(f"Serving stale cache for {key} after database error: {e}")
+                return entry["body"]
+            raise
+        
+        self.set(key, {"generated_at": now, "stale_at": now + fresh_seconds, "body": body}, fresh_seconds + fallback_seconds)
+        return body
+
+    def _evict_local(self) -> None:
+        """Drop expired local entries, then the oldest ones if still over capacity"""
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._local.items() if expires < now]:
+            del self._local[key]
+        while len(self._local) >= MAX_LOCAL_ENTRIES:
+            del self._local[next(iter(self._local))]
+
+
+# Global instance
+cache = Cache(settings.redis_url)
@@ -1,8 +1,11 @@
 from pydantic_settings import BaseSettings
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from functools import lru_cache
 import json
 import os
 
+__all__ = ["Settings", "get_settings", "settings"]
+
 
 class Settings(BaseSettings):
     database_url: str
@@ -12,6 +15,9 @@ class Settings(BaseSettings):
     face_recognition_tolerance: float = 0.4  # Stricter tolerance for better security
     gps_tolerance_meters: int = 100
     allowed_locations: Dict[str, Any] = {}
+    redis_url: Optional[str] = None
+    user_cache_ttl_seconds: int = 60
+    debug: bool = False
     cors_origins: List[str] = ["http://localhost:3000", "http://localhost:3001", "http://127.0.0.1:3000", "http://127.0.0.1:3001"]
 
     class Config:
@@ -42,4 +48,10 @@ class Settings(BaseSettings):
                 self.cors_origins = [origin.strip() for origin in cors_origins_str.split(",") if origin.strip()]
 
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build the settings once per process, parsing the environment a single time."""
+    return Settings()
+
+
+settings = get_settings()
\ No newline at end of file
@@ -3,15 +3,21 @@ CORS Configuration Module
 Handles Cross-Origin Resource Sharing settings for the attendance system
 """
 from typing import List
+from functools import lru_cache
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
+import logging
 import os
 
+logger = logging.getLogger(__name__)
 
+
+@lru_cache(maxsize=1)
 def get_cors_origins() -> List[str]:
     """
     Get CORS origins based on environment.
     Returns appropriate origins for development, staging, and production.
+    The environment is read once per process; treat the returned list as read-only.
     """
     # Default development origins
     default_origins = [
@@ -78,7 +84,8 @@ def get_exposed_headers() -> List[str]:
         "Content-Length",
         "Content-Type",
         "X-Total-Count",
-        "X-Page-Count"
+        "X-Page-Count",
+        "X-Next-Cursor"
     ]
 
 
@@ -92,11 +99,11 @@ def configure_cors(app) -> None:
     origins = get_cors_origins()
     
     # Log CORS configuration for debugging
-    print(f"CORS Origins: {origins}")
+    logger.info("CORS Origins: %s", origins)
     
     app.add_middleware(
         CORSMiddleware,
-        allow_origins=origins,
+        allow_origins=_allowed_origin_set(),  # Set, so the per-request origin check is a hash lookup
         allow_credentials=True,
         allow_methods=get_cors_methods(),
         allow_headers=get_cors_headers(),
@@ -115,8 +122,13 @@ def is_origin_allowed(origin: str) -> bool:
     Returns:
         bool: True if origin is allowed, False otherwise
     """
-    allowed_origins = get_cors_origins()
-    return origin in allowed_origins
+    return origin in _allowed_origin_set()
+
+
+@lru_cache(maxsize=1)
+def _allowed_origin_set() -> frozenset:
+    """Allowed origins as a set for constant-time membership checks."""
+    return frozenset(get_cors_origins())
 
 
 # CORS configuration for different environments
@@ -129,8 +141,8 @@ CORS_CONFIG = {
             "http://127.0.0.1:3001"
         ],
         "credentials": True,
-        "methods": ["*"],
-        "headers": ["*"]
+        "methods": get_cors_methods(),
+        "headers": get_cors_headers()
     },
     "staging": {
         "origins": [
@@ -1,12 +1,89 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, DDL, Index
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, raiseload
 from app.core.config import settings
 
-engine = create_engine(settings.database_url)
+# Dialect INSERT constructs that support ON CONFLICT clauses
+INSERT_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# Extra sync engine options per DBAPI driver; psycopg2 folds executemany INSERT/UPDATE/DELETE into batches
+DRIVER_ENGINE_OPTIONS = {
+    "psycopg2": {"executemany_mode": "values_plus_batch"},
+}
+
+# Pool options for every engine: a cheap liveness check on checkout replaces dead-connection
+# failures after idle periods, and recycling stays ahead of server-side idle timeouts
+POOL_OPTIONS = {
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+
+# Queue pool sizing per database backend; SQLite keeps SQLAlchemy's default pool for its file or memory mode
+BACKEND_POOL_OPTIONS = {
+    "postgresql": {"pool_size": 10, "max_overflow": 20},
+}
+
+# Extension providing the trigram operator classes, installed once before the schema's tables and indexes
+PG_TRGM_EXTENSION = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+
+# Async drivers used for the same database as the sync engine
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """Translate the configured database URL to its async driver equivalent."""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}'")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def get_pool_options(database_url: str) -> dict:
+    """Build the connection pool options for an engine on the given database."""
+    return {**POOL_OPTIONS, **BACKEND_POOL_OPTIONS.get(make_url(database_url).get_backend_name(), {})}
+
+
+engine = create_engine(
+    settings.database_url,
+    **get_pool_options(settings.database_url),
+    **DRIVER_ENGINE_OPTIONS.get(make_url(settings.database_url).get_driver_name(), {})
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    get_async_database_url(settings.database_url),
+    **get_pool_options(settings.database_url)
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
+event.listen(Base.metadata, "before_create", PG_TRGM_EXTENSION)
+
+# Query options that make any implicit relationship lazy load raise in debug,
+# so eager-loaded listing queries cannot silently regress into N+1 round-trips
+LAZY_LOAD_GUARD = (raiseload("*"),) if settings.debug else ()
+
+
+def trigram_index(name: str, column_name: str) -> Index:
+    """Declare a PostgreSQL trigram GIN index serving ILIKE '%term%' searches; skipped on other databases."""
+    return Index(
+        name, column_name, postgresql_using="gin", postgresql_ops={column_name: "gin_trgm_ops"}
+    ).ddl_if(dialect="postgresql")
+
+
+def dialect_insert(db, model):
+    """Build an INSERT for model that supports on_conflict_do_nothing on the session's database."""
+    return INSERT_DIALECTS[db.get_bind().dialect.name](model)
 
 
 def get_db():
@@ -14,4 +91,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
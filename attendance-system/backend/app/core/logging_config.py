@@ -0,0 +1,38 @@
+"""
+Logging Configuration Module
+Routes application logs through a background queue so request threads never block on output
+"""
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from app.core.config import settings
+
+# Every application module's logger descends from this one
+APP_LOGGER_NAME = "app"
+
+# Format of each application log line
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging() -> None:
+    """
+    Attach a queued stdout handler to the application logger.
+    A listener thread does the writing, so slow stdout never stalls a request.
+    Safe to call more than once; only the first call configures anything.
+    """
+    logger = logging.getLogger(APP_LOGGER_NAME)
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return
+    
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG if settings.debug else logging.INFO)
+    logger.propagate = False
@@ -1,17 +1,65 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
+from collections import OrderedDict
 from typing import Optional, Dict, Any
-from jose import JWTError, jwt
+from jose import JWTError, jwt, jwk
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
 from app.core.config import settings
+import hashlib
+import hmac
+import threading
+import time
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor, pinned so hashing cost does not drift with passlib's default
+BCRYPT_ROUNDS = 12
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Token signing key, constructed once instead of on every encode and decode
+signing_key = jwk.construct(settings.secret_key, settings.algorithm)
+
+# Number of distinct tokens whose decoded payload is kept in memory
+TOKEN_CACHE_SIZE = 8192
+
+# Seconds a successful password check is remembered, so repeated logins skip the bcrypt work
+PASSWORD_CACHE_TTL_SECONDS = 30
+
+# Number of recently verified credentials kept in memory
+PASSWORD_CACHE_SIZE = 1024
+
+_verified_passwords: "OrderedDict[bytes, float]" = OrderedDict()
+_verified_passwords_lock = threading.Lock()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_password_cached(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password, skipping the hash when the same credential verified moments ago."""
+    # Keyed by a secret-keyed digest that includes the stored hash, so a password change invalidates it
+    key = hmac.new(
+        settings.secret_key.encode(), f"{hashed_password}\0{plain_password}".encode(), hashlib.sha256
+    ).digest()
+    now = time.monotonic()
+    with _verified_passwords_lock:
+        expires = _verified_passwords.get(key)
+        if expires is not None and expires > now:
+            return True
+    
+    # Only successes are remembered, so a wrong password always costs a full hash
+    if not verify_password(plain_password, hashed_password):
+        return False
+    
+    with _verified_passwords_lock:
+        _verified_passwords[key] = now + PASSWORD_CACHE_TTL_SECONDS
+        _verified_passwords.move_to_end(key)
+        while len(_verified_passwords) > PASSWORD_CACHE_SIZE:
+            _verified_passwords.popitem(last=False)
+    return True
+
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -29,7 +77,7 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     to_encode.update({"exp": expire})
     
     try:
-        encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
+        encoded_jwt = jwt.encode(to_encode, signing_key, algorithm=settings.algorithm)
         return encoded_jwt
     except Exception as e:
         raise HTTPException(
@@ -38,13 +86,24 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
         )
 
 
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _decode_token(token: str) -> Dict[str, Any]:
+    """Verify the signature and decode a token, memoized so repeat requests skip the crypto."""
+    return jwt.decode(token, signing_key, algorithms=[settings.algorithm])
+
+
 def verify_token(token: str) -> Dict[str, Any]:
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        return payload
+        payload = _decode_token(token)
     except JWTError:
+        payload = None
+    
+    # Cached payloads outlive jwt.decode's own expiry check, so re-check it here
+    if payload is None or payload.get("exp", 0) <= time.time():
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
+    
+    return dict(payload)
\ No newline at end of file
@@ -1,14 +1,22 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from app.api import auth, attendance, courses, students, face_registration
 from app.core.config import settings
 from app.core.cors import configure_cors
+from app.core.logging_config import configure_logging
+
+__all__ = ["app"]
 
 app = FastAPI(
     title="Attendance Management System",
     description="Face Recognition + GPS based Attendance System for Federal University of Technology, Akure",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Route application logs through a background queue before anything logs
+configure_logging()
+
 # Configure CORS using centralized configuration
 configure_cors(app)
 
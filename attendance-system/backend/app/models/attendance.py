@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, Index
+from sqlalchemy.orm import relationship, query_expression
 from datetime import datetime
 from app.core.database import Base
 
@@ -18,15 +18,26 @@ class AttendanceSession(Base):
     location_lng = Column(Float)
     location_radius = Column(Float, default=100.0)
     
+    __table_args__ = (
+        # Partial index: only active sessions are looked up by course
+        Index(
+            "ix_attendance_sessions_course_active", course_id, is_active,
+            postgresql_where=is_active.is_(True), sqlite_where=is_active.is_(True)
+        ),
+    )
+    
     course = relationship("Course")
     attendances = relationship("Attendance", back_populates="session")
+    
+    # Populated per query via with_expression(), e.g. an aggregated attendance count
+    attendance_count = query_expression()
 
 
 class Attendance(Base):
     __tablename__ = "attendance"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("attendance_sessions.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("attendance_sessions.id"), nullable=False, index=True)
     student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
     marked_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     present = Column(Boolean, default=True, nullable=False)
@@ -40,5 +51,12 @@ class Attendance(Base):
     processing_time_ms = Column(Integer)   # End-to-end latency in milliseconds
     verification_status = Column(String(20))  # 'accepted', 'rejected_face', 'rejected_gps'
     
+    __table_args__ = (
+        Index("ix_attendance_student_marked", student_id, marked_at.desc()),
+        # One record per student per session; also covers per-student attendance counts
+        # grouped or filtered by session (and so by course)
+        Index("uq_attendance_student_session", student_id, session_id, unique=True),
+    )
+    
     session = relationship("AttendanceSession", back_populates="attendances")
     student = relationship("Student")
\ No newline at end of file
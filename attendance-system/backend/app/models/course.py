@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -10,11 +10,16 @@ class Course(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
     code = Column(String(20), unique=True, nullable=False, index=True)
-    lecturer_id = Column(Integer, ForeignKey("lecturers.id"), nullable=False)
+    lecturer_id = Column(Integer, ForeignKey("lecturers.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     lecturer = relationship("Lecturer", back_populates="courses")
     students = relationship("Student", secondary="course_students", back_populates="courses")
+    
+    # Lets course-ownership probes be answered from the index alone
+    __table_args__ = (
+        Index("ix_courses_id_lecturer_id", id, lecturer_id),
+    )
 
 
 class CourseStudent(Base):
@@ -22,6 +27,11 @@ class CourseStudent(Base):
 
     course_id = Column(Integer, ForeignKey("courses.id"), primary_key=True)
     student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
+    
+    # The primary key already covers lookups by course_id
+    __table_args__ = (
+        Index("ix_course_students_student_id", student_id),
+    )
 
 
 class CoursePermission(Base):
@@ -33,4 +43,10 @@ class CoursePermission(Base):
     granted_at = Column(DateTime, default=datetime.utcnow)
     
     course = relationship("Course")
-    lecturer = relationship("Lecturer")
\ No newline at end of file
+    # Only ever read through an explicit eager load; lazy access would be a per-row query
+    lecturer = relationship("Lecturer", lazy="raise")
+    
+    # Covers permission lookups by course and by (course, lecturer), and makes grants idempotent
+    __table_args__ = (
+        Index("uq_course_permissions_course_lecturer", course_id, lecturer_id, unique=True),
+    )
\ No newline at end of file
@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, Boolean, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, Boolean, DateTime, Index
+from sqlalchemy.orm import relationship, deferred, column_property
 from datetime import datetime
-from app.core.database import Base
+from app.core.database import Base, trigram_index
 
 
 class User(Base):
@@ -14,6 +14,13 @@ class User(Base):
     role = Column(String(50), nullable=False)  # 'student' or 'lecturer'
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    
+    __table_args__ = (
+        # Lets the student search's substring match on name use an index instead of a scan
+        trigram_index("ix_users_name_trgm", "name"),
+        # Exact name lookups for lecturer login and registration
+        Index("ix_users_name_role", "name", "role"),
+    )
 
 
 class Student(Base):
@@ -21,14 +28,28 @@ class Student(Base):
 
     id = Column(Integer, ForeignKey("users.id"), primary_key=True)
     matric_no = Column(String(50), unique=True, nullable=False, index=True)
-    facial_encoding = Column(Text)  # Legacy dlib encoding
-    advanced_facial_encoding = Column(Text)  # JSON with multiple model embeddings
+    # Encodings are only loaded when verifying a face; both load together when either is accessed
+    facial_encoding = deferred(Column(Text), group="face_encodings")  # Legacy dlib encoding
+    advanced_facial_encoding = deferred(Column(Text), group="face_encodings")  # JSON with multiple model embeddings
     face_registered = Column(Boolean, default=False)
     face_registration_method = Column(String(50), default="basic")  # "basic" or "advanced"
     department = Column(String(255))
     level = Column(String(10))
+    # Denormalized counts kept current by the enrollment and attendance writes, so listings read them directly
+    course_count = Column(Integer, default=0, server_default="0", nullable=False)
+    attendance_count = Column(Integer, default=0, server_default="0", nullable=False)
     user = relationship("User", backref="student_profile")
     courses = relationship("Course", secondary="course_students", back_populates="students")
+    
+    # Presence flags evaluated in SQL, so listings never transfer the encodings themselves
+    has_facial_encoding = column_property(facial_encoding.expression.isnot(None))
+    has_advanced_facial_encoding = column_property(advanced_facial_encoding.expression.isnot(None))
+    
+    # Let the student search and department filter substring matches use an index instead of a scan
+    __table_args__ = (
+        trigram_index("ix_students_matric_no_trgm", "matric_no"),
+        trigram_index("ix_students_department_trgm", "department"),
+    )
 
 
 class Lecturer(Base):
@@ -1,13 +1,60 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, undefer_group, joinedload, load_only
 from fastapi import HTTPException, status
 from app.models.attendance import AttendanceSession, Attendance
-from app.models.user import Student
+from app.models.user import User, Student
+from app.models.course import CourseStudent
 from app.utils.face_recognition import verify_face, verify_face_advanced
-from app.utils.gps_verification import verify_location
+from app.utils.gps_verification import verify_location, haversine_distances
+from app.services.performance_metrics import invalidate_performance_cache
+from app.core.cache import cache, STUDENT_LISTINGS_NAMESPACE
 from app.core.config import settings
-from typing import Dict, Any, List
+from app.core.database import LAZY_LOAD_GUARD
+from typing import Dict, Any, List, Tuple
 from datetime import datetime
 import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Guidance appended to a rejected attendance attempt
+LOCATION_TIPS = "\n\n💡 Location Tips:\n• Enable location services\n• Move closer to the session location\n• Ensure GPS signal is strong\n• Try refreshing your location"
+FACE_VERIFICATION_TIPS = "\n\n💡 Face Verification Tips:\n• Ensure good lighting\n• Face the camera directly\n• Remove glasses/masks if possible\n• Keep your face steady"
+
+# Location rejections keyed by why the GPS check failed, tips included so each needs one format call
+LOCATION_ERRORS = {
+    "too_far": (
+        "📍 Location Too Far: You are {distance:.1f}m away from the session location. "
+        "You must be within {radius}m to mark attendance. "
+        "Please move closer to the classroom/session location."
+    ) + LOCATION_TIPS,
+    "gps_error": (
+        "📍 Location Error: GPS verification failed despite being {distance:.1f}m away. "
+        "Please check your location settings and try again."
+    ) + LOCATION_TIPS,
+    "unknown": (
+        "📍 Location Invalid: Cannot determine your location. "
+        "Please enable location services, ensure GPS is working, and try again."
+    ) + LOCATION_TIPS,
+}
+
+# Face rejections keyed by the verification step that failed
+FACE_ERRORS = {
+    "missing": "❌ Face Image Missing: No face image was captured. Please ensure your camera is working and try again.",
+    "not_registered": "❌ Face Not Registered: You must register your face before marking attendance. Please go to 'Register Face' in your profile first.",
+    "advanced_mismatch": "❌ Advanced Face Verification Failed: Confidence {confidence:.2f} below threshold {tolerance}. The captured face does not match your registered face with sufficient certainty.",
+    "fallback_failed": "❌ Face Verification Failed: Could not verify face using advanced method, basic fallback also failed.",
+    "no_basic_encoding": "❌ Face Verification Error: Advanced verification failed and no basic encoding available.",
+    "no_face": "❌ No Face Detected: Cannot detect a face in the captured image. Please ensure good lighting, face the camera directly, and try again.",
+    "mismatch": "❌ Face Mismatch: The captured face does not match your registered face. Please ensure you are the registered student and face the camera clearly.",
+    "unknown": "❌ Face Verification Failed: Unknown face verification error",
+}
+
+# Redis Bloom filter of the students who have marked a session, kept a while past the session's end
+MARKED_FILTER_KEY = "attendance_marked:{session_id}"
+MARKED_FILTER_GRACE_SECONDS = 3600
 
 
 def create_attendance_session(
@@ -34,13 +81,27 @@ def create_attendance_session(
         db.add(session)
         db.commit()
         db.refresh(session)
-        return session
     except Exception as e:
         db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create attendance session"
         )
+    
+    reserve_marked_filter(db, session)
+    return session
+
+
+def reserve_marked_filter(db: Session, session: AttendanceSession) -> None:
+    """Size a session's marked-students Bloom filter for its course enrollment."""
+    if cache.client is None:
+        return
+    
+    enrolled = db.query(func.count(CourseStudent.student_id)).filter(
+        CourseStudent.course_id == session.course_id
+    ).scalar()
+    ttl = max(int((session.end_time - datetime.utcnow()).total_seconds()), 0) + MARKED_FILTER_GRACE_SECONDS
+    cache.bloom_reserve(MARKED_FILTER_KEY.format(session_id=session.id), enrolled, ttl)
 
 
 def mark_attendance_with_verification(
@@ -69,16 +130,20 @@ def mark_attendance_with_verification(
                 detail="Active session not found"
             )
         
-        # Get student
-        student = db.query(Student).filter(Student.id == student_id).first()
+        # Get student together with the encodings needed for verification
+        student = db.query(Student).options(
+            undefer_group("face_encodings")
+        ).filter(Student.id == student_id).first()
         if not student:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Student not found"
             )
         
-        # Check if already marked
-        existing_attendance = db.query(Attendance).filter(
+        # Check if already marked; a definite miss in the session's Bloom filter skips the lookup,
+        # and the unique index still rejects a duplicate the filter failed to record
+        marked_key = MARKED_FILTER_KEY.format(session_id=session_id)
+        existing_attendance = cache.bloom_might_contain(marked_key, student_id) and db.query(Attendance).filter(
             Attendance.session_id == session_id,
             Attendance.student_id == student_id
         ).first()
@@ -89,16 +154,40 @@ def mark_attendance_with_verification(
                 detail="Attendance already marked for this session"
             )
         
+        # Verify GPS location first; it is cheap, and a student out of range is rejected
+        # without running face inference
+        gps_verification = verify_location(
+            student_lat,
+            student_lng,
+            session.location_lat,
+            session.location_lng,
+            session.location_radius
+        )
+        
+        # Check location verification with detailed error
+        if not gps_verification["is_valid"]:
+            distance = gps_verification.get('distance_meters')
+            reason = "unknown" if distance is None else "too_far" if distance > session.location_radius else "gps_error"
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=LOCATION_ERRORS[reason].format(distance=distance, radius=session.location_radius)
+            )
+        
+        # End the read transaction and return the connection to the pool while the face models
+        # run; the loaded rows stay usable once detached
+        db.close()
+        
         # Handle face recognition - STRICT VERIFICATION REQUIRED
+        tolerance = settings.face_recognition_tolerance
         face_verified = False
         face_error = None
         verification_details = {}
         
         if not face_image_data:
-            face_error = "❌ Face Image Missing: No face image was captured. Please ensure your camera is working and try again."
+            face_error = FACE_ERRORS["missing"]
         elif not student.facial_encoding and not student.advanced_facial_encoding:
             # Student must register face first - NO attendance without registered face
-            face_error = "❌ Face Not Registered: You must register your face before marking attendance. Please go to 'Register Face' in your profile first."
+            face_error = FACE_ERRORS["not_registered"]
         else:
             # Use advanced verification if available, fallback to basic
             if student.advanced_facial_encoding and student.face_registration_method == "advanced":
@@ -107,7 +196,7 @@ def mark_attendance_with_verification(
                     verification_result = verify_face_advanced(
                         student.advanced_facial_encoding,
                         face_image_data,
-                        settings.face_recognition_tolerance
+                        tolerance
                     )
                     
                     face_verified = verification_result.get('match', False)
@@ -120,7 +209,7 @@ def mark_attendance_with_verification(
                     
                     if not face_verified:
                         confidence = verification_result.get('confidence', 0.0)
-                        face_error = f"❌ Advanced Face Verification Failed: Confidence {confidence:.2f} below threshold {settings.face_recognition_tolerance}. The captured face does not match your registered face with sufficient certainty."
+                        face_error = FACE_ERRORS["advanced_mismatch"].format(confidence=confidence, tolerance=tolerance)
                         
                 except Exception as e:
                     # Fallback to basic verification if advanced fails
@@ -128,86 +217,40 @@ def mark_attendance_with_verification(
                         face_verified = verify_face(
                             student.facial_encoding,
                             face_image_data,
-                            settings.face_recognition_tolerance
+                            tolerance
                         )
                         verification_details = {'method': 'basic_fallback'}
                         if not face_verified:
-                            face_error = "❌ Face Verification Failed: Could not verify face using advanced method, basic fallback also failed."
+                            face_error = FACE_ERRORS["fallback_failed"]
                     else:
-                        face_error = "❌ Face Verification Error: Advanced verification failed and no basic encoding available."
+                        face_error = FACE_ERRORS["no_basic_encoding"]
             else:
                 # Use basic verification
-                from app.utils.face_recognition import encode_face_from_base64
+                from app.utils.face_recognition import decode_image, encode_face_from_base64, encodings_match
+                
+                # Decode and encode the captured face once; the encoding serves both detection and verification
+                image = decode_image(face_image_data)
                 
                 # First check if we can detect a face in the current image
-                current_encoding = encode_face_from_base64(face_image_data)
+                current_encoding = encode_face_from_base64(image) if image is not None else None
                 if not current_encoding:
-                    face_error = "❌ No Face Detected: Cannot detect a face in the captured image. Please ensure good lighting, face the camera directly, and try again."
+                    face_error = FACE_ERRORS["no_face"]
                 else:
                     # Now verify against stored encoding
-                    face_verified = verify_face(
+                    face_verified = encodings_match(
                         student.facial_encoding,
-                        face_image_data,
-                        settings.face_recognition_tolerance
+                        current_encoding,
+                        tolerance
                     )
                     verification_details = {'method': 'basic'}
                     if not face_verified:
-                        face_error = "❌ Face Mismatch: The captured face does not match your registered face. Please ensure you are the registered student and face the camera clearly."
-        
-        # Verify GPS location
-        gps_verification = verify_location(
-            student_lat,
-            student_lng,
-            session.location_lat,
-            session.location_lng,
-            session.location_radius
-        )
+                        face_error = FACE_ERRORS["mismatch"]
         
         # CRITICAL: Both face AND location verification must pass - NO EXCEPTIONS
-        verification_errors = []
-        
-        # Check face verification with detailed error
         if not face_verified:
-            verification_errors.append(face_error or "❌ Face Verification Failed: Unknown face verification error")
-        
-        # Check location verification with detailed error
-        if not gps_verification["is_valid"]:
-            distance = gps_verification.get('distance_meters')
-            if distance is not None:
-                if distance > session.location_radius:
-                    verification_errors.append(
-                        f"📍 Location Too Far: You are {distance:.1f}m away from the session location. "
-                        f"You must be within {session.location_radius}m to mark attendance. "
-                        f"Please move closer to the classroom/session location."
-                    )
-                else:
-                    verification_errors.append(
-                        f"📍 Location Error: GPS verification failed despite being {distance:.1f}m away. "
-                        f"Please check your location settings and try again."
-                    )
-            else:
-                verification_errors.append(
-                    "📍 Location Invalid: Cannot determine your location. "
-                    "Please enable location services, ensure GPS is working, and try again."
-                )
-        
-        # Provide comprehensive feedback based on what failed
-        if verification_errors:
-            if len(verification_errors) == 1:
-                # Single failure - provide specific guidance
-                error_message = verification_errors[0]
-                if "Face" in error_message:
-                    error_message += "\n\n💡 Face Verification Tips:\n• Ensure good lighting\n• Face the camera directly\n• Remove glasses/masks if possible\n• Keep your face steady"
-                elif "Location" in error_message:
-                    error_message += "\n\n💡 Location Tips:\n• Enable location services\n• Move closer to the session location\n• Ensure GPS signal is strong\n• Try refreshing your location"
-            else:
-                # Multiple failures - provide combined guidance
-                error_message = "Multiple verification failures:\n\n" + "\n\n".join(verification_errors)
-                error_message += "\n\n💡 Please fix all issues above and try again."
-            
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=error_message
+                detail=(face_error or FACE_ERRORS["unknown"]) + FACE_VERIFICATION_TIPS
             )
         
         # Final safety check
@@ -231,13 +274,29 @@ def mark_attendance_with_verification(
             verification_status='accepted'
         )
         
-        db.add(attendance)
+        # The unique (student, session) index rejects a duplicate marked while verification ran
+        try:
+            db.add(attendance)
+            db.flush()
+        except IntegrityError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Attendance already marked for this session"
+            )
+        db.execute(
+            update(Student).where(Student.id == student_id).values(attendance_count=Student.attendance_count + 1)
+        )
         db.commit()
+        cache.bloom_add(marked_key, student_id)
+        invalidate_performance_cache(session_id)
+        cache.bump_namespace(STUDENT_LISTINGS_NAMESPACE)
         
         # Log successful verification for audit
-        print(f"ATTENDANCE MARKED: Student {student_id} verified for session {session_id} - "
-              f"Face: {face_verified}, Location: {gps_verification['is_valid']}, "
-              f"Distance: {gps_verification.get('distance_meters', 'N/A')}m")
+        logger.info(
+            "ATTENDANCE MARKED: Student %s verified for session %s - Face: %s, Location: %s, Distance: %sm",
+            student_id, session_id, face_verified, gps_verification['is_valid'],
+            gps_verification.get('distance_meters', 'N/A')
+        )
         
         return {
             "message": "Attendance marked successfully",
@@ -260,35 +319,40 @@ def mark_attendance_with_verification(
         )
 
 
+def check_attendance_integrity_bulk(records: List[Tuple[Attendance, AttendanceSession]]) -> Dict[int, bool]:
+    """Check many attendance records against their loaded sessions in one vectorized pass."""
+    if not records:
+        return {}
+    
+    # Missing coordinates become NaN, which fails every comparison below just as verify_location rejects them
+    coordinates = np.array([
+        (attendance.student_lat, attendance.student_lng, session.location_lat, session.location_lng, session.location_radius)
+        for attendance, session in records
+    ], dtype=np.float64)
+    student_lat, student_lng, session_lat, session_lng, radius = coordinates.T
+    
+    in_bounds = (
+        (np.abs(student_lat) <= 90) & (np.abs(student_lng) <= 180)
+        & (np.abs(session_lat) <= 90) & (np.abs(session_lng) <= 180)
+    )
+    within_radius = haversine_distances(session_lat, session_lng, student_lat, student_lng) <= radius
+    
+    return {
+        attendance.id: attendance.verification_method == "face_gps_verified" and bool(is_valid)
+        for (attendance, _), is_valid in zip(records, in_bounds & within_radius)
+    }
+
+
 def validate_attendance_integrity(db: Session, attendance_id: int) -> bool:
     """Validate that an attendance record meets all verification requirements."""
     try:
-        attendance = db.query(Attendance).filter(Attendance.id == attendance_id).first()
-        if not attendance:
-            return False
-        
-        # Check that verification method indicates proper verification
-        if attendance.verification_method != "face_gps_verified":
-            return False
-        
-        # Check that location data exists
-        if attendance.student_lat is None or attendance.student_lng is None:
-            return False
-        
-        # Get session and verify location is within range
-        session = db.query(AttendanceSession).filter(AttendanceSession.id == attendance.session_id).first()
-        if not session:
+        attendance = db.query(Attendance).options(
+            joinedload(Attendance.session)
+        ).filter(Attendance.id == attendance_id).first()
+        if not attendance or not attendance.session:
             return False
         
-        location_check = verify_location(
-            attendance.student_lat,
-            attendance.student_lng,
-            session.location_lat,
-            session.location_lng,
-            session.location_radius
-        )
-        
-        return location_check["is_valid"]
+        return check_attendance_integrity_bulk([(attendance, attendance.session)])[attendance.id]
     except Exception:
         return False
 
@@ -296,30 +360,44 @@ def validate_attendance_integrity(db: Session, attendance_id: int) -> bool:
 def get_session_attendance(db: Session, session_id: int) -> List[Dict[str, Any]]:
     """Get attendance records for a session."""
     try:
-        attendances = db.query(Attendance).filter(
+        # Load every record with its student, user and session in one round-trip
+        rows = db.query(Attendance, Student, User, AttendanceSession).join(
+            Student, Student.id == Attendance.student_id
+        ).join(
+            User, User.id == Student.id
+        ).join(
+            AttendanceSession, AttendanceSession.id == Attendance.session_id
+        ).options(
+            load_only(
+                Attendance.marked_at, Attendance.present, Attendance.verification_method,
+                Attendance.student_lat, Attendance.student_lng
+            ),
+            load_only(Student.matric_no),
+            load_only(User.name),
+            load_only(AttendanceSession.location_lat, AttendanceSession.location_lng, AttendanceSession.location_radius),
+            *LAZY_LOAD_GUARD
+        ).filter(
             Attendance.session_id == session_id
         ).all()
         
+        # Check every record's location in a single vectorized pass
+        verified = check_attendance_integrity_bulk([(attendance, session) for attendance, _, _, session in rows])
+        
         result = []
-        for attendance in attendances:
-            student = db.query(Student).filter(Student.id == attendance.student_id).first()
-            if student:
-                # Validate attendance integrity
-                is_valid = validate_attendance_integrity(db, attendance.id)
-                
-                result.append({
-                    "student_id": student.id,
-                    "student_name": student.user.name,
-                    "matric_no": student.matric_no,
-                    "marked_at": attendance.marked_at,
-                    "present": attendance.present,
-                    "verification_method": attendance.verification_method,
-                    "verified": is_valid
-                })
+        for attendance, student, user, session in rows:
+            result.append({
+                "student_id": student.id,
+                "student_name": user.name,
+                "matric_no": student.matric_no,
+                "marked_at": attendance.marked_at,
+                "present": attendance.present,
+                "verification_method": attendance.verification_method,
+                "verified": verified[attendance.id]
+            })
         
         return result
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to retrieve attendance records"
-        )
\ No newline at end of file
+        )
@@ -1,7 +1,9 @@
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 from app.models.user import User, Student, Lecturer
-from app.core.security import verify_password, get_password_hash, create_access_token
+from app.core.security import verify_password_cached, get_password_hash, create_access_token
+from app.core.cache import cache, STUDENT_LISTINGS_NAMESPACE
 from typing import Optional, Dict, Any
 
 
@@ -12,7 +14,7 @@ def authenticate_user(db: Session, identifier: str, password: str) -> Optional[U
         student = db.query(Student).filter(Student.matric_no == identifier).first()
         if student:
             user = db.query(User).filter(User.id == student.id).first()
-            if user and verify_password(password, user.hashed_password):
+            if user and verify_password_cached(password, user.hashed_password):
                 return user
         
         # Try name for lecturers
@@ -20,7 +22,7 @@ def authenticate_user(db: Session, identifier: str, password: str) -> Optional[U
             User.name == identifier,
             User.role == "lecturer"
         ).first()
-        if user and verify_password(password, user.hashed_password):
+        if user and verify_password_cached(password, user.hashed_password):
             return user
             
         return None
@@ -54,7 +56,7 @@ def get_user_profile(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
             student = db.query(Student).filter(Student.id == user_id).first()
             if student:
                 profile["matric_no"] = student.matric_no
-                profile["has_facial_encoding"] = bool(student.facial_encoding)
+                profile["has_facial_encoding"] = student.has_facial_encoding
                 profile["face_registered"] = student.face_registered
         elif user.role == "lecturer":
             lecturer = db.query(Lecturer).filter(Lecturer.id == user_id).first()
@@ -71,8 +73,8 @@ def get_user_profile(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
 def register_student(db: Session, name: str, password: str, matric_no: str) -> Dict[str, Any]:
     """Register new student."""
     try:
-        # Check if matric_no already exists
-        if db.query(Student).filter(Student.matric_no == matric_no).first():
+        # Check if matric_no already exists; EXISTS returns a boolean instead of a row
+        if db.query(exists().where(Student.matric_no == matric_no)).scalar():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Matriculation number already registered"
@@ -94,6 +96,7 @@ def register_student(db: Session, name: str, password: str, matric_no: str) -> D
         )
         db.add(student)
         db.commit()
+        cache.bump_namespace(STUDENT_LISTINGS_NAMESPACE)
         
         return {"message": "Student registered successfully", "user_id": user.id}
         
@@ -112,7 +115,7 @@ def register_lecturer(db: Session, name: str, password: str) -> Dict[str, Any]:
     """Register new lecturer."""
     try:
         # Check if name already exists for lecturers
-        if db.query(User).filter(User.name == name, User.role == "lecturer").first():
+        if db.query(exists().where(User.name == name, User.role == "lecturer")).scalar():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Lecturer name already registered"
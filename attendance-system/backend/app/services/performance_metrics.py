@@ -1,41 +1,67 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, case
 from app.models.attendance import Attendance
-from typing import Dict, List
-import statistics
+from app.core.cache import cache
+from typing import Dict, List, Optional
+import numpy as np
+
+# Reports served by the /performance endpoints, each cached per session
+PERFORMANCE_REPORTS = ("metrics", "biometric", "efficiency", "security")
+
+# Dialects that compute the median GPS accuracy in SQL with percentile_cont
+PERCENTILE_DIALECTS = {"postgresql"}
+
+# Verification outcomes of attempts treated as unauthorized
+REJECTED_STATUSES = ("rejected_face", "rejected_gps")
+
+
+def performance_cache_key(report: str, session_id: Optional[int]) -> str:
+    return f"performance:{report}:{session_id}"
+
+
+def invalidate_performance_cache(session_id: int) -> None:
+    """Drop cached reports affected by a new attendance record in a session."""
+    cache.delete(*[
+        performance_cache_key(report, key_session_id)
+        for report in PERFORMANCE_REPORTS
+        for key_session_id in (session_id, None)
+    ])
 
 
 class PerformanceMetrics:
-    def __init__(self, db: Session):
-        self.db = db
-    
-    def calculate_biometric_metrics(self, session_id: int = None) -> Dict:
+    def calculate_biometric_metrics(self, db: Session, session_id: int = None) -> Dict:
         """Calculate FAR, FRR, and EER for biometric performance"""
-        query = self.db.query(Attendance)
+        query = db.query(Attendance.verification_status, Attendance.present, func.count())
         if session_id:
             query = query.filter(Attendance.session_id == session_id)
         
-        attendances = query.all()
+        # Count attempts per outcome in the database instead of transferring every row, then tally
+        # the grouped rows in a single pass
+        total_attempts = accepted = rejected = unauthorized_accepted = authorized_rejected = 0
+        for verification_status, present, count in query.group_by(
+            Attendance.verification_status, Attendance.present
+        ):
+            total_attempts += count
+            if verification_status == 'accepted':
+                accepted += count
+                if not present:
+                    authorized_rejected += count
+            elif verification_status in REJECTED_STATUSES:
+                rejected += count
+                if present:
+                    unauthorized_accepted += count
         
-        # Separate authorized vs unauthorized attempts
-        accepted = [a for a in attendances if a.verification_status == 'accepted']
-        rejected_face = [a for a in attendances if a.verification_status == 'rejected_face']
-        rejected_gps = [a for a in attendances if a.verification_status == 'rejected_gps']
-        
-        total_attempts = len(attendances)
         if total_attempts == 0:
             return {"FAR": 0, "FRR": 0, "EER": 0, "total_attempts": 0}
         
         # Calculate FAR (False Acceptance Rate)
         # Assuming rejected attempts were unauthorized
-        unauthorized_accepted = len([a for a in rejected_face + rejected_gps if a.present])
-        total_unauthorized = len(rejected_face) + len(rejected_gps)
+        total_unauthorized = rejected
         FAR = (unauthorized_accepted / total_unauthorized * 100) if total_unauthorized > 0 else 0
         
         # Calculate FRR (False Rejection Rate)
         # Assuming accepted attempts were authorized
-        authorized_rejected = len([a for a in accepted if not a.present])
-        total_authorized = len(accepted)
+        total_authorized = accepted
         FRR = (authorized_rejected / total_authorized * 100) if total_authorized > 0 else 0
         
         # EER is typically where FAR = FRR
@@ -46,47 +72,61 @@ class PerformanceMetrics:
             "FRR": round(FRR, 2), 
             "EER": round(EER, 2),
             "total_attempts": total_attempts,
-            "accepted": len(accepted),
-            "rejected": len(rejected_face) + len(rejected_gps)
+            "accepted": accepted,
+            "rejected": rejected
         }
     
-    def calculate_system_efficiency(self, session_id: int = None) -> Dict:
+    def calculate_system_efficiency(self, db: Session, session_id: int = None) -> Dict:
         """Calculate GPS accuracy and latency metrics"""
-        query = self.db.query(Attendance).filter(Attendance.gps_accuracy_meters.isnot(None))
+        filters = [Attendance.gps_accuracy_meters.isnot(None)]
         if session_id:
-            query = query.filter(Attendance.session_id == session_id)
+            filters.append(Attendance.session_id == session_id)
         
-        attendances = query.all()
+        # Sample count and latency statistics in one aggregate query
+        recorded_latency = case((Attendance.processing_time_ms != 0, Attendance.processing_time_ms))
+        samples, avg_latency, max_latency, min_latency = db.query(
+            func.count(),
+            func.avg(recorded_latency),
+            func.max(recorded_latency),
+            func.min(recorded_latency)
+        ).filter(*filters).one()
         
-        if not attendances:
+        if not samples:
             return {"CEP": 0, "avg_latency_ms": 0, "samples": 0}
         
         # Calculate CEP (Circular Error Probability) - 50th percentile of GPS accuracy
-        gps_accuracies = [a.gps_accuracy_meters for a in attendances if a.gps_accuracy_meters]
-        CEP = statistics.median(gps_accuracies) if gps_accuracies else 0
-        
-        # Calculate average latency
-        latencies = [a.processing_time_ms for a in attendances if a.processing_time_ms]
-        avg_latency = statistics.mean(latencies) if latencies else 0
+        recorded_accuracy = [*filters, Attendance.gps_accuracy_meters != 0]
+        if db.get_bind().dialect.name in PERCENTILE_DIALECTS:
+            CEP = db.query(
+                func.percentile_cont(0.5).within_group(Attendance.gps_accuracy_meters.asc())
+            ).filter(*recorded_accuracy).scalar() or 0
+        else:
+            gps_accuracies = np.fromiter(
+                (accuracy for (accuracy,) in db.query(Attendance.gps_accuracy_meters).filter(*recorded_accuracy)),
+                dtype=np.float64
+            )
+            CEP = float(np.median(gps_accuracies)) if gps_accuracies.size else 0
         
         return {
             "CEP": round(CEP, 2),
-            "avg_latency_ms": round(avg_latency, 2),
-            "max_latency_ms": max(latencies) if latencies else 0,
-            "min_latency_ms": min(latencies) if latencies else 0,
-            "samples": len(attendances)
+            "avg_latency_ms": round(float(avg_latency or 0), 2),
+            "max_latency_ms": max_latency or 0,
+            "min_latency_ms": min_latency or 0,
+            "samples": samples
         }
     
-    def get_security_analysis(self, session_id: int = None) -> Dict:
+    def get_security_analysis(self, db: Session, session_id: int = None) -> Dict:
         """Analyze security robustness against spoofing attempts"""
-        query = self.db.query(Attendance)
+        query = db.query(Attendance.verification_status, func.count())
         if session_id:
             query = query.filter(Attendance.session_id == session_id)
         
-        total = query.count()
-        gps_rejected = query.filter(Attendance.verification_status == 'rejected_gps').count()
-        face_rejected = query.filter(Attendance.verification_status == 'rejected_face').count()
-        accepted = query.filter(Attendance.verification_status == 'accepted').count()
+        # Count every outcome in a single grouped query
+        counts = dict(query.group_by(Attendance.verification_status).all())
+        total = sum(counts.values())
+        gps_rejected = counts.get('rejected_gps', 0)
+        face_rejected = counts.get('rejected_face', 0)
+        accepted = counts.get('accepted', 0)
         
         return {
             "total_attempts": total,
@@ -95,11 +135,7 @@ class PerformanceMetrics:
             "successful_verifications": accepted,
             "security_effectiveness": round((gps_rejected + face_rejected) / total * 100, 2) if total > 0 else 0
         }
-    
-    def generate_performance_report(self, session_id: int = None) -> Dict:
-        """Generate comprehensive performance report"""
-        return {
-            "biometric_metrics": self.calculate_biometric_metrics(session_id),
-            "system_efficiency": self.calculate_system_efficiency(session_id),
-            "security_analysis": self.get_security_analysis(session_id)
-        }
\ No newline at end of file
+
+
+# Global instance
+metrics_service = PerformanceMetrics()
@@ -7,7 +7,9 @@ import numpy as np
 import base64
 import io
 from PIL import Image
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import logging
 
 # Import face recognition libraries
@@ -35,26 +37,121 @@ try:
 except ImportError:
     MEDIAPIPE_AVAILABLE = False
 
+try:
+    import pybase64
+    PYBASE64_AVAILABLE = True
+except ImportError:
+    PYBASE64_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# DeepFace models used for the embedding ensemble
+DEEPFACE_MODELS = ['Facenet', 'VGG-Face', 'OpenFace']
+
+# Weight of each model's similarity in the ensemble confidence; unlisted models weigh 0.1
+MODEL_WEIGHTS = {
+    'insightface': 0.35,
+    'deepface_facenet': 0.25,
+    'dlib': 0.20,
+    'deepface_vgg-face': 0.15,
+    'deepface_openface': 0.05
+}
+
+# Distance from the threshold at which the embeddings that come free with detection
+# decide a comparison on their own, skipping the DeepFace ensemble
+CASCADE_DECISION_MARGIN = 0.15
+
+# Intersection over union above which two detections are taken to be the same face
+CONSENSUS_IOU_THRESHOLD = 0.5
+
+# Longest side of the InsightFace detector input, the previous fixed 640x640; smaller frames are
+# detected at their own resolution rounded up to the multiple of 32 the detector needs
+INSIGHTFACE_MAX_DET_SIZE = 640
+
+# Frame resolutions given their own prepared InsightFace analyzer; each new one loads another copy
+# of the models, so frames beyond this reuse the first analyzer and its letterboxing
+INSIGHTFACE_MAX_RESOLUTIONS = 2
+
+# Best InsightFace detection score below which the MediaPipe and dlib detectors also run
+PRIMARY_DETECTION_CONFIDENCE = 0.5
+
+
+def decode_base64_image(image_data: str) -> np.ndarray:
+    """Decode base64 image data to an RGB array, straight from the buffer for formats OpenCV reads"""
+    if PYBASE64_AVAILABLE:
+        image_bytes = pybase64.b64decode(image_data, validate=False)
+    else:
+        image_bytes = base64.b64decode(image_data)
+    
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is not None:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    
+    # Fall back to PIL for formats OpenCV cannot read
+    return np.array(Image.open(io.BytesIO(image_bytes)))
+
+
+def cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
+    """Cosine similarity of two embeddings in float32, using dot products only."""
+    a = np.asarray(embedding1, dtype=np.float32)
+    b = np.asarray(embedding2, dtype=np.float32)
+    return float(np.dot(a, b) / np.sqrt(np.dot(a, a) * np.dot(b, b)))
+
 
 class AdvancedFaceRecognition:
     """Advanced face recognition using multiple models for enhanced accuracy"""
     
     def __init__(self):
         self.models = {}
+        # Detectors and ensemble members run native inference that releases the GIL, so threads overlap them
+        self.executor = ThreadPoolExecutor(max_workers=len(DEEPFACE_MODELS), thread_name_prefix="face-ensemble")
+        self._thread_state = threading.local()
+        self._insightface_by_res = {}
+        self._insightface_lock = threading.Lock()
         self._initialize_models()
     
+    def _create_mediapipe_detector(self):
+        """Build a MediaPipe face detector"""
+        return mp.solutions.face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.7)
+    
+    def _mediapipe_detector(self):
+        """MediaPipe detector owned by the calling thread; a detector's graph is not reentrant"""
+        detector = getattr(self._thread_state, 'mediapipe', None)
+        if detector is None:
+            detector = self._thread_state.mediapipe = self._create_mediapipe_detector()
+        return detector
+    
+    def _insightface_analyzer(self, image: np.ndarray):
+        """InsightFace analyzer prepared for the frame's resolution, preparing one on first sight of it"""
+        h, w = image.shape[:2]
+        scale = min(1.0, INSIGHTFACE_MAX_DET_SIZE / max(w, h))
+        det_size = tuple(-(-round(side * scale) // 32) * 32 for side in (w, h))
+        
+        analyzer = self._insightface_by_res.get(det_size)
+        if analyzer is not None:
+            return analyzer
+        
+        with self._insightface_lock:
+            analyzer = self._insightface_by_res.get(det_size)
+            if analyzer is None:
+                if len(self._insightface_by_res) >= INSIGHTFACE_MAX_RESOLUTIONS:
+                    return next(iter(self._insightface_by_res.values()))
+                # The analyzer loaded at startup serves the first resolution seen
+                if self._insightface_by_res:
+                    analyzer = insightface.app.FaceAnalysis(providers=['CPUExecutionProvider'])
+                else:
+                    analyzer = self.models['insightface']
+                analyzer.prepare(ctx_id=0, det_size=det_size)
+                self._insightface_by_res[det_size] = analyzer
+        return analyzer
+    
     def _initialize_models(self):
         """Initialize available face recognition models"""
         
         # Initialize MediaPipe Face Detection
         if MEDIAPIPE_AVAILABLE:
             try:
-                mp_face_detection = mp.solutions.face_detection
-                self.models['mediapipe'] = mp_face_detection.FaceDetection(
-                    model_selection=1, min_detection_confidence=0.7
-                )
+                self.models['mediapipe'] = self._thread_state.mediapipe = self._create_mediapipe_detector()
                 logger.info("MediaPipe face detection initialized")
             except Exception as e:
                 logger.warning(f"Failed to initialize MediaPipe: {e}")
@@ -62,21 +159,21 @@ class AdvancedFaceRecognition:
         # Initialize InsightFace
         if INSIGHTFACE_AVAILABLE:
             try:
-                app = insightface.app.FaceAnalysis(providers=['CPUExecutionProvider'])
-                app.prepare(ctx_id=0, det_size=(640, 640))
-                self.models['insightface'] = app
+                # Prepared for a detection size once the first frame shows the camera's resolution
+                self.models['insightface'] = insightface.app.FaceAnalysis(providers=['CPUExecutionProvider'])
                 logger.info("InsightFace initialized")
             except Exception as e:
                 logger.warning(f"Failed to initialize InsightFace: {e}")
     
-    def _decode_image(self, image_data: str) -> np.ndarray:
+    def _decode_image(self, image_data: Union[str, np.ndarray]) -> np.ndarray:
         """Decode base64 image to numpy array"""
+        if isinstance(image_data, np.ndarray):
+            return image_data
+        
         if ',' in image_data:
             image_data = image_data.split(',')[1]
         
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        return np.array(image)
+        return decode_base64_image(image_data)
     
     def detect_faces_mediapipe(self, image: np.ndarray) -> List[Dict]:
         """Detect faces using MediaPipe"""
@@ -84,8 +181,8 @@ class AdvancedFaceRecognition:
             return []
         
         try:
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            results = self.models['mediapipe'].process(rgb_image)
+            # Frames are decoded to RGB, the order MediaPipe expects, so they go in without a conversion pass
+            results = self._mediapipe_detector().process(image)
             
             faces = []
             if results.detections:
@@ -113,7 +210,7 @@ class AdvancedFaceRecognition:
             return []
         
         try:
-            faces = self.models['insightface'].get(image)
+            faces = self._insightface_analyzer(image).get(image)
             results = []
             
             for face in faces:
@@ -174,8 +271,42 @@ class AdvancedFaceRecognition:
             logger.error(f"DeepFace embedding error: {e}")
             return None
     
-    def comprehensive_face_analysis(self, image_data: str) -> Dict:
-        """Perform comprehensive face analysis using all available models"""
+    def get_deepface_embeddings(self, face_region: np.ndarray) -> Dict[str, np.ndarray]:
+        """Get DeepFace embeddings of a face region with every ensemble model concurrently"""
+        futures = {
+            model: self.executor.submit(self.get_face_embedding_deepface, face_region, model)
+            for model in DEEPFACE_MODELS
+        }
+        embeddings = {}
+        for model, future in futures.items():
+            embedding = future.result()
+            if embedding is not None:
+                embeddings[f'deepface_{model.lower()}'] = embedding
+        return embeddings
+    
+    def _detect_primary(self, image: np.ndarray) -> Dict[str, List[Dict]]:
+        """Detect faces with InsightFace, which returns ArcFace embeddings with each detection"""
+        return {'insightface': self.detect_faces_insightface(image)}
+    
+    def _detect_fallback(self, image: np.ndarray) -> Dict[str, List[Dict]]:
+        """Detect faces with MediaPipe and dlib concurrently, for frames the primary detector cannot settle"""
+        mediapipe_future = self.executor.submit(self.detect_faces_mediapipe, image)
+        dlib_faces = self.detect_faces_dlib(image)
+        return {
+            'mediapipe': mediapipe_future.result(),
+            'dlib': dlib_faces
+        }
+    
+    def comprehensive_face_analysis(
+        self,
+        image_data: Union[str, np.ndarray],
+        extra_models: bool = False,
+        full_detection: bool = False
+    ) -> Dict:
+        """
+        Detect and embed faces, running the primary detector first and the others only when needed.
+        extra_models adds the DeepFace embedding ensemble; full_detection always runs the fallback detectors.
+        """
         try:
             image = self._decode_image(image_data)
             
@@ -187,26 +318,24 @@ class AdvancedFaceRecognition:
                 'best_face': None
             }
             
-            # Detect faces with different models
-            all_faces = []
-            
-            # MediaPipe detection
-            mp_faces = self.detect_faces_mediapipe(image)
-            if mp_faces:
-                all_faces.extend(mp_faces)
-                results['models_used'].append('mediapipe')
-            
-            # InsightFace detection
-            if_faces = self.detect_faces_insightface(image)
-            if if_faces:
-                all_faces.extend(if_faces)
-                results['models_used'].append('insightface')
+            # The fallback detectors only run when InsightFace finds nothing or only weak detections;
+            # when every detector is wanted up front, all of them run at once
+            if full_detection:
+                primary_future = self.executor.submit(self._detect_primary, image)
+                fallback = self._detect_fallback(image)
+                detections = primary_future.result()
+                detections.update(fallback)
+            else:
+                detections = self._detect_primary(image)
+                primary_faces = detections['insightface']
+                if not primary_faces or max(face['confidence'] for face in primary_faces) < PRIMARY_DETECTION_CONFIDENCE:
+                    detections.update(self._detect_fallback(image))
             
-            # Dlib detection
-            dlib_faces = self.detect_faces_dlib(image)
-            if dlib_faces:
-                all_faces.extend(dlib_faces)
-                results['models_used'].append('dlib')
+            all_faces = []
+            for model, faces in detections.items():
+                if faces:
+                    all_faces.extend(faces)
+                    results['models_used'].append(model)
             
             if not all_faces:
                 return results
@@ -214,20 +343,17 @@ class AdvancedFaceRecognition:
             # Find consensus faces (faces detected by multiple models)
             consensus_faces = self._find_consensus_faces(all_faces)
             
-            # Get best face based on confidence and size
-            best_face = self._select_best_face(consensus_faces, image.shape)
+            # Get best face based on confidence and size; its score doubles as the quality score
+            scores = self._score_faces(consensus_faces, image.shape)
+            best_index = int(scores.argmax())
+            best_face = consensus_faces[best_index] if scores[best_index] > 0 else None
             
             if best_face:
                 # Get multiple embeddings for the best face
                 face_region = self._extract_face_region(image, best_face['bbox'])
                 
-                embeddings = {}
-                
-                # Get DeepFace embeddings with different models
-                for model in ['Facenet', 'VGG-Face', 'OpenFace']:
-                    embedding = self.get_face_embedding_deepface(face_region, model)
-                    if embedding is not None:
-                        embeddings[f'deepface_{model.lower()}'] = embedding
+                # Get DeepFace embeddings only on request, keeping the region to compute them later
+                embeddings = self.get_deepface_embeddings(face_region) if extra_models else {}
                 
                 # Get InsightFace embedding if available
                 if 'embedding' in best_face:
@@ -242,7 +368,8 @@ class AdvancedFaceRecognition:
                     'face_data': consensus_faces,
                     'best_face': best_face,
                     'embeddings': embeddings,
-                    'quality_score': self._calculate_quality_score(best_face, image.shape)
+                    'face_region': face_region,
+                    'quality_score': float(scores[best_index])
                 })
             
             return results
@@ -256,52 +383,39 @@ class AdvancedFaceRecognition:
         if len(all_faces) <= 1:
             return all_faces
         
+        # Pairwise IoU of every detection in one broadcast over (x1, y1, x2, y2) corners
+        boxes = np.array([face['bbox'] for face in all_faces], dtype=np.float64)
+        corners = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+        top_left = np.maximum(corners[:, None, :2], corners[None, :, :2])
+        bottom_right = np.minimum(corners[:, None, 2:], corners[None, :, 2:])
+        intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+        areas = boxes[:, 2] * boxes[:, 3]
+        union = areas[:, None] + areas[None, :] - intersection
+        iou = np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+        # Each detection only groups with later ones, as in the original pairwise scan
+        overlaps = np.triu(iou > CONSENSUS_IOU_THRESHOLD, k=1)
+        
         consensus_faces = []
-        used_indices = set()
+        used = np.zeros(len(all_faces), dtype=bool)
         
         for i, face1 in enumerate(all_faces):
-            if i in used_indices:
+            if used[i]:
                 continue
-                
-            similar_faces = [face1]
-            used_indices.add(i)
             
-            for j, face2 in enumerate(all_faces[i+1:], i+1):
-                if j in used_indices:
-                    continue
-                    
-                if self._faces_overlap(face1['bbox'], face2['bbox']):
-                    similar_faces.append(face2)
-                    used_indices.add(j)
+            # Group the detection with every later unused one overlapping it
+            matches = np.flatnonzero(overlaps[i] & ~used)
+            used[i] = True
+            used[matches] = True
             
             # Create consensus face
-            if len(similar_faces) > 1:
-                consensus_face = self._merge_face_detections(similar_faces)
+            if len(matches):
+                consensus_face = self._merge_face_detections([face1] + [all_faces[j] for j in matches])
                 consensus_faces.append(consensus_face)
             else:
                 consensus_faces.append(face1)
         
         return consensus_faces
     
-    def _faces_overlap(self, bbox1: Tuple, bbox2: Tuple, threshold: float = 0.5) -> bool:
-        """Check if two face bounding boxes overlap significantly"""
-        x1, y1, w1, h1 = bbox1
-        x2, y2, w2, h2 = bbox2
-        
-        # Calculate intersection
-        x_overlap = max(0, min(x1 + w1, x2 + w2) - max(x1, x2))
-        y_overlap = max(0, min(y1 + h1, y2 + h2) - max(y1, y2))
-        intersection = x_overlap * y_overlap
-        
-        # Calculate union
-        area1 = w1 * h1
-        area2 = w2 * h2
-        union = area1 + area2 - intersection
-        
-        # Calculate IoU
-        iou = intersection / union if union > 0 else 0
-        return iou > threshold
-    
     def _merge_face_detections(self, faces: List[Dict]) -> Dict:
         """Merge multiple face detections into a consensus"""
         # Average bounding boxes
@@ -329,82 +443,36 @@ class AdvancedFaceRecognition:
         
         return merged_face
     
-    def _select_best_face(self, faces: List[Dict], image_shape: Tuple) -> Optional[Dict]:
-        """Select the best face based on confidence, size, and consensus"""
-        if not faces:
-            return None
+    def _score_faces(self, faces: List[Dict], image_shape: Tuple) -> np.ndarray:
+        """Score every face on confidence, size, centering, and consensus in one vectorized pass"""
+        h, w = image_shape[:2]
+        boxes = np.array([face['bbox'] for face in faces], dtype=np.float64).reshape(-1, 4)
+        confidence = np.array([face['confidence'] for face in faces], dtype=np.float64)
+        consensus = np.array([face.get('consensus_count', 1) for face in faces], dtype=np.float64)
         
-        best_face = None
-        best_score = 0
+        # Size score, optimal when the face covers 10% of the image
+        size_score = np.minimum(boxes[:, 2] * boxes[:, 3] / (w * h) * 10, 1.0)
         
-        h, w = image_shape[:2]
+        # Position score (prefer centered faces)
+        center_distance = np.hypot(boxes[:, 0] + boxes[:, 2] / 2 - w / 2, boxes[:, 1] + boxes[:, 3] / 2 - h / 2)
+        position_score = 1 - center_distance / np.hypot(w / 2, h / 2)
         
-        for face in faces:
-            x, y, width, height = face['bbox']
-            
-            # Calculate face area ratio
-            face_area = width * height
-            image_area = w * h
-            area_ratio = face_area / image_area
-            
-            # Calculate position score (prefer centered faces)
-            center_x, center_y = x + width/2, y + height/2
-            image_center_x, image_center_y = w/2, h/2
-            center_distance = np.sqrt((center_x - image_center_x)**2 + (center_y - image_center_y)**2)
-            max_distance = np.sqrt((w/2)**2 + (h/2)**2)
-            position_score = 1 - (center_distance / max_distance)
-            
-            # Calculate consensus score
-            consensus_score = face.get('consensus_count', 1) / 3  # Normalize by max possible models
-            
-            # Combined score
-            score = (
-                face['confidence'] * 0.4 +
-                min(area_ratio * 10, 1.0) * 0.3 +  # Prefer faces that are 10% of image
-                position_score * 0.2 +
-                consensus_score * 0.1
-            )
-            
-            if score > best_score:
-                best_score = score
-                best_face = face
+        # Consensus score, normalized by the number of detectors
+        consensus_score = consensus / 3
         
-        return best_face
+        return confidence * 0.4 + size_score * 0.3 + position_score * 0.2 + consensus_score * 0.1
     
     def _extract_face_region(self, image: np.ndarray, bbox: Tuple) -> np.ndarray:
         """Extract face region from image"""
         x, y, w, h = bbox
         return image[y:y+h, x:x+w]
     
-    def _calculate_quality_score(self, face: Dict, image_shape: Tuple) -> float:
-        """Calculate overall quality score for the face"""
-        x, y, w, h = face['bbox']
-        img_h, img_w = image_shape[:2]
-        
-        # Size score
-        face_area = w * h
-        image_area = img_w * img_h
-        area_ratio = face_area / image_area
-        size_score = min(area_ratio * 10, 1.0)  # Optimal at 10% of image
-        
-        # Position score
-        center_x, center_y = x + w/2, y + h/2
-        img_center_x, img_center_y = img_w/2, img_h/2
-        center_distance = np.sqrt((center_x - img_center_x)**2 + (center_y - img_center_y)**2)
-        max_distance = np.sqrt((img_w/2)**2 + (img_h/2)**2)
-        position_score = 1 - (center_distance / max_distance)
-        
-        # Confidence score
-        confidence_score = face['confidence']
-        
-        # Consensus score
-        consensus_score = face.get('consensus_count', 1) / 3
-        
-        return (size_score * 0.3 + position_score * 0.2 + confidence_score * 0.4 + consensus_score * 0.1)
-    
-    def compare_faces_advanced(self, known_embeddings: Dict, test_image_data: str, threshold: float = 0.6) -> Dict:
-        """Advanced face comparison using multiple models"""
-        test_analysis = self.comprehensive_face_analysis(test_image_data)
+    def compare_faces_advanced(self, known_embeddings: Dict, test_image_data: Union[str, np.ndarray], threshold: float = 0.6) -> Dict:
+        """Advanced face comparison using multiple models, cheapest first"""
+        # Registrations without an InsightFace embedding can only be matched through the fallback detectors
+        test_analysis = self.comprehensive_face_analysis(
+            test_image_data, full_detection='insightface' not in known_embeddings
+        )
         
         if test_analysis['faces_detected'] == 0:
             return {
@@ -413,7 +481,18 @@ class AdvancedFaceRecognition:
                 'reason': 'No face detected in test image'
             }
         
+        # Score the embeddings that came with detection first; a clear match or mismatch
+        # returns without running the DeepFace ensemble
         test_embeddings = test_analysis.get('embeddings', {})
+        model_results = self._compare_embeddings(known_embeddings, test_embeddings)
+        needs_deepface = any(model.startswith('deepface') for model in known_embeddings)
+        if model_results and needs_deepface:
+            needs_deepface = abs(self._weighted_confidence(model_results) - threshold) < CASCADE_DECISION_MARGIN
+        
+        if needs_deepface:
+            test_embeddings.update(self.get_deepface_embeddings(test_analysis['face_region']))
+            model_results = self._compare_embeddings(known_embeddings, test_embeddings)
+        
         if not test_embeddings:
             return {
                 'match': False,
@@ -421,18 +500,6 @@ class AdvancedFaceRecognition:
                 'reason': 'Could not extract embeddings from test image'
             }
         
-        # Compare embeddings from different models
-        model_results = {}
-        
-        for model_name in known_embeddings:
-            if model_name in test_embeddings:
-                similarity = self._calculate_similarity(
-                    known_embeddings[model_name],
-                    test_embeddings[model_name],
-                    model_name
-                )
-                model_results[model_name] = similarity
-        
         if not model_results:
             return {
                 'match': False,
@@ -440,24 +507,7 @@ class AdvancedFaceRecognition:
                 'reason': 'No compatible embeddings found'
             }
         
-        # Weighted average of model results
-        weights = {
-            'insightface': 0.35,
-            'deepface_facenet': 0.25,
-            'dlib': 0.20,
-            'deepface_vgg-face': 0.15,
-            'deepface_openface': 0.05
-        }
-        
-        weighted_score = 0.0
-        total_weight = 0.0
-        
-        for model, score in model_results.items():
-            weight = weights.get(model, 0.1)
-            weighted_score += score * weight
-            total_weight += weight
-        
-        final_confidence = weighted_score / total_weight if total_weight > 0 else 0.0
+        final_confidence = self._weighted_confidence(model_results)
         is_match = final_confidence > threshold
         
         return {
@@ -468,29 +518,46 @@ class AdvancedFaceRecognition:
             'quality_score': test_analysis.get('quality_score', 0.0)
         }
     
+    def _compare_embeddings(self, known_embeddings: Dict, test_embeddings: Dict) -> Dict[str, float]:
+        """Similarity per model for every model present on both sides"""
+        known = {model: np.asarray(known_embeddings[model], dtype=np.float32).ravel() for model in known_embeddings if model in test_embeddings}
+        test = {model: np.asarray(test_embeddings[model], dtype=np.float32).ravel() for model in known}
+        
+        # Cosine-scored models are laid end to end so one pass of segment sums yields every model's
+        # dot products; dlib and malformed pairs go through the per-model path
+        cosine_models = [model for model in known if model != 'dlib' and known[model].size and known[model].size == test[model].size]
+        results = {
+            model: self._calculate_similarity(known[model], test[model], model)
+            for model in known if model not in cosine_models
+        }
+        if cosine_models:
+            known_flat = np.concatenate([known[model] for model in cosine_models])
+            test_flat = np.concatenate([test[model] for model in cosine_models])
+            offsets = np.cumsum([0] + [known[model].size for model in cosine_models[:-1]])
+            dots = np.add.reduceat(known_flat * test_flat, offsets)
+            norms = np.sqrt(np.add.reduceat(known_flat * known_flat, offsets) * np.add.reduceat(test_flat * test_flat, offsets))
+            similarities = (dots / norms + 1) / 2
+            results.update(zip(cosine_models, similarities.tolist()))
+        
+        return {model: results[model] for model in known}
+    
+    def _weighted_confidence(self, model_results: Dict[str, float]) -> float:
+        """Weighted average of model similarities"""
+        weights = np.array([MODEL_WEIGHTS.get(model, 0.1) for model in model_results])
+        scores = np.fromiter(model_results.values(), dtype=np.float64, count=len(model_results))
+        total_weight = weights.sum()
+        return float(weights @ scores / total_weight) if total_weight > 0 else 0.0
+    
     def _calculate_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray, model_name: str) -> float:
         """Calculate similarity between two embeddings"""
         try:
-            if model_name.startswith('deepface') or model_name == 'insightface':
-                # Cosine similarity for deep learning models
-                dot_product = np.dot(embedding1, embedding2)
-                norm1 = np.linalg.norm(embedding1)
-                norm2 = np.linalg.norm(embedding2)
-                similarity = dot_product / (norm1 * norm2)
-                return (similarity + 1) / 2  # Normalize to 0-1
-            
-            elif model_name == 'dlib':
+            if model_name == 'dlib':
                 # Euclidean distance for dlib (lower is better)
                 distance = np.linalg.norm(embedding1 - embedding2)
                 return max(0, 1 - distance)  # Convert to similarity score
             
-            else:
-                # Default cosine similarity
-                dot_product = np.dot(embedding1, embedding2)
-                norm1 = np.linalg.norm(embedding1)
-                norm2 = np.linalg.norm(embedding2)
-                similarity = dot_product / (norm1 * norm2)
-                return (similarity + 1) / 2
+            # Cosine similarity for deep learning models, normalized to 0-1
+            return (cosine_similarity(embedding1, embedding2) + 1) / 2
                 
         except Exception as e:
             logger.error(f"Similarity calculation error for {model_name}: {e}")
@@ -1,26 +1,72 @@
 import face_recognition
 import numpy as np
-from typing import Optional, List, Dict
-from PIL import Image
-import io
+from typing import Optional, List, Dict, Union
 import base64
+import hashlib
 import logging
-from app.utils.advanced_face_recognition import advanced_face_recognition
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from app.utils.advanced_face_recognition import advanced_face_recognition, decode_base64_image
 
 logger = logging.getLogger(__name__)
 
+# Basic-encoding distance margins (relative to tolerance) that are decisive
+# enough to skip the advanced multi-model verification
+CLEAR_MATCH_MARGIN = 0.75
+CLEAR_MISMATCH_MARGIN = 1.5
 
-def encode_face_from_base64(image_data: str) -> Optional[str]:
-    """Extract face encoding from base64 image data."""
+# Stored encodings with this prefix hold a float32 scale followed by int8 values (base64)
+QUANTIZED_ENCODING_PREFIX = "int8:"
+
+# Recently decoded frames, keyed by a digest of their base64 data, so a resubmitted image
+# (retries, a test before registering) skips base64 and codec decoding
+DECODED_IMAGE_CACHE_SIZE = 64
+_decoded_images: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_decoded_images_lock = threading.Lock()
+
+
+def decode_image(image_data: str) -> Optional[np.ndarray]:
+    """
+    Decode base64 image data (optionally a data URL) to a numpy array.
+    Recent decodes are shared between callers; treat the returned array as read-only.
+    """
     try:
         # Remove data URL prefix if present
         if ',' in image_data:
             image_data = image_data.split(',')[1]
         
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
+        key = hashlib.sha1(image_data.encode()).digest()
+        with _decoded_images_lock:
+            image = _decoded_images.get(key)
+            if image is not None:
+                _decoded_images.move_to_end(key)
+                return image
+        
+        # Decode straight from the buffer with OpenCV's SIMD codecs
+        image = decode_base64_image(image_data)
+        with _decoded_images_lock:
+            _decoded_images[key] = image
+            while len(_decoded_images) > DECODED_IMAGE_CACHE_SIZE:
+                _decoded_images.popitem(last=False)
+        return image
+    except Exception:
+        return None
+
+
+def _as_image_array(image_data: Union[str, np.ndarray]) -> Optional[np.ndarray]:
+    """Return an already decoded image as-is, decoding base64 data otherwise."""
+    if isinstance(image_data, np.ndarray):
+        return image_data
+    return decode_image(image_data)
+
+
+def encode_face_from_base64(image_data: Union[str, np.ndarray]) -> Optional[str]:
+    """Extract face encoding from base64 image data or a decoded image array."""
+    try:
+        image_array = _as_image_array(image_data)
+        if image_array is None:
+            return None
         
         # Get face encodings
         face_encodings = face_recognition.face_encodings(image_array)
@@ -36,11 +82,18 @@ def encode_face_from_base64(image_data: str) -> Optional[str]:
         return None
 
 
-def validate_and_encode_face_advanced(image_data: str, test_only: bool = False) -> dict:
+def validate_and_encode_face_advanced(image_data: Union[str, np.ndarray], test_only: bool = False) -> dict:
     """Advanced face validation and encoding using multiple models."""
     try:
-        # Use advanced face recognition for comprehensive analysis
-        analysis = advanced_face_recognition.comprehensive_face_analysis(image_data)
+        # Decode once through the shared cache; the analysis and the basic fallback both reuse the array
+        image_array = _as_image_array(image_data)
+        if image_array is None:
+            return validate_and_encode_face(image_data, test_only)
+        image_data = image_array
+        
+        # Use advanced face recognition for comprehensive analysis; registration runs every detector
+        # so the stored template also carries the dlib encoding
+        analysis = advanced_face_recognition.comprehensive_face_analysis(image_data, full_detection=not test_only)
         
         if analysis['faces_detected'] == 0:
             return {
@@ -80,11 +133,14 @@ def validate_and_encode_face_advanced(image_data: str, test_only: bool = False)
             # Store all embeddings as JSON for multi-model verification
             embeddings = analysis.get('embeddings', {})
             if embeddings:
-                # Convert numpy arrays to lists for JSON serialization
+                # Store each embedding vector int8-quantized for JSON serialization; cosine-scored
+                # models are L2-normalized first, dlib keeps its magnitude for Euclidean distance
                 serializable_embeddings = {}
                 for model, embedding in embeddings.items():
-                    if isinstance(embedding, np.ndarray):
-                        serializable_embeddings[model] = embedding.tolist()
+                    if isinstance(embedding, (np.ndarray, list)):
+                        if model != 'dlib':
+                            embedding = unit_vector(embedding)
+                        serializable_embeddings[model] = quantize_encoding(embedding)
                     else:
                         serializable_embeddings[model] = embedding
                 
@@ -93,7 +149,7 @@ def validate_and_encode_face_advanced(image_data: str, test_only: bool = False)
             
             # Fallback to traditional encoding for backward compatibility
             if 'dlib' in embeddings:
-                result["encoding"] = ','.join(map(str, embeddings['dlib']))
+                result["encoding"] = quantize_encoding(embeddings['dlib'])
         
         return result
         
@@ -103,17 +159,13 @@ def validate_and_encode_face_advanced(image_data: str, test_only: bool = False)
         return validate_and_encode_face(image_data, test_only)
 
 
-def validate_and_encode_face(image_data: str, test_only: bool = False) -> dict:
+def validate_and_encode_face(image_data: Union[str, np.ndarray], test_only: bool = False) -> dict:
     """Original face validation method (kept for backward compatibility)."""
     try:
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
+        # Decode base64 image unless already decoded
+        image_array = _as_image_array(image_data)
+        if image_array is None:
+            raise ValueError("could not decode image data")
         
         # Check image dimensions
         height, width = image_array.shape[:2]
@@ -229,7 +281,7 @@ def validate_and_encode_face(image_data: str, test_only: bool = False) -> dict:
         }
         
         if not test_only:
-            result["encoding"] = ','.join(map(str, encoding))
+            result["encoding"] = quantize_encoding(encoding)
         
         return result
         
@@ -241,7 +293,7 @@ def validate_and_encode_face(image_data: str, test_only: bool = False) -> dict:
         }
 
 
-def verify_face_advanced(known_embeddings_json: str, image_data: str, tolerance: float = 0.6) -> Dict:
+def verify_face_advanced(known_embeddings_json: str, image_data: Union[str, np.ndarray], tolerance: float = 0.6) -> Dict:
     """Advanced face verification using multiple models."""
     try:
         import json
@@ -249,14 +301,17 @@ def verify_face_advanced(known_embeddings_json: str, image_data: str, tolerance:
         # Parse known embeddings
         known_embeddings = json.loads(known_embeddings_json)
         
-        # Convert lists back to numpy arrays
+        # Convert quantized strings and legacy float lists back to numpy arrays; only dlib is
+        # scored by Euclidean distance and needs the original magnitude
         for model, embedding in known_embeddings.items():
-            if isinstance(embedding, list):
+            if isinstance(embedding, str) and embedding.startswith(QUANTIZED_ENCODING_PREFIX):
+                known_embeddings[model] = parse_encoding(embedding) if model == 'dlib' else unit_encoding(embedding)
+            elif isinstance(embedding, list):
                 known_embeddings[model] = np.array(embedding)
         
-        # Compare using advanced face recognition
+        # Compare using advanced face recognition, decoding through the shared cache
         result = advanced_face_recognition.compare_faces_advanced(
-            known_embeddings, image_data, tolerance
+            known_embeddings, _as_image_array(image_data), tolerance
         )
         
         return result
@@ -268,7 +323,9 @@ def verify_face_advanced(known_embeddings_json: str, image_data: str, tolerance:
             try:
                 known_embeddings = json.loads(known_embeddings_json)
                 if 'dlib' in known_embeddings:
-                    dlib_encoding = ','.join(map(str, known_embeddings['dlib']))
+                    dlib_encoding = known_embeddings['dlib']
+                    if not isinstance(dlib_encoding, str):
+                        dlib_encoding = ','.join(map(str, dlib_encoding))
                     is_match = verify_face(dlib_encoding, image_data, tolerance)
                     return {
                         'match': is_match,
@@ -285,22 +342,76 @@ def verify_face_advanced(known_embeddings_json: str, image_data: str, tolerance:
         }
 
 
-def verify_face(known_encoding_str: str, image_data: str, tolerance: float = 0.6) -> bool:
+def quantize_encoding(encoding) -> str:
+    """Serialize a face encoding for storage as symmetric int8 values with one float32 scale."""
+    encoding = np.asarray(encoding, dtype=np.float32)
+    scale = np.float32(np.max(np.abs(encoding)) / 127.0) if encoding.size else np.float32(0.0)
+    if scale == 0:
+        scale = np.float32(1.0)
+    quantized = np.clip(np.round(encoding / scale), -127, 127).astype(np.int8)
+    return QUANTIZED_ENCODING_PREFIX + base64.b64encode(scale.tobytes() + quantized.tobytes()).decode('ascii')
+
+
+@lru_cache(maxsize=1024)
+def parse_encoding(encoding_str: str) -> np.ndarray:
+    """Parse a stored face encoding (int8-quantized or legacy comma-separated), memoized so each is parsed once."""
+    if encoding_str.startswith(QUANTIZED_ENCODING_PREFIX):
+        raw = base64.b64decode(encoding_str[len(QUANTIZED_ENCODING_PREFIX):])
+        scale = np.frombuffer(raw[:4], dtype=np.float32)[0]
+        encoding = np.frombuffer(raw[4:], dtype=np.int8).astype(np.float64) * scale
+    else:
+        encoding = np.array(encoding_str.split(','), dtype=np.float64)
+    encoding.setflags(write=False)
+    return encoding
+
+
+def unit_vector(encoding) -> np.ndarray:
+    """L2-normalize an embedding as float32, leaving a zero vector unchanged."""
+    encoding = np.asarray(encoding, dtype=np.float32)
+    norm = np.sqrt(np.dot(encoding, encoding))
+    return encoding / norm if norm > 0 else encoding
+
+
+@lru_cache(maxsize=1024)
+def unit_encoding(encoding_str: str) -> np.ndarray:
+    """Parse a stored int8-quantized encoding straight to a unit-length float32 vector for cosine scoring."""
+    raw = base64.b64decode(encoding_str[len(QUANTIZED_ENCODING_PREFIX):])
+    # The shared scale cancels out under normalization, so the int8 values are used as-is
+    encoding = unit_vector(np.frombuffer(raw[4:], dtype=np.int8))
+    encoding.setflags(write=False)
+    return encoding
+
+
+def encoding_distance(known_encoding_str: str, new_encoding_str: str) -> float:
+    """Euclidean distance between two comma-separated face encodings."""
+    new_encoding = np.array(new_encoding_str.split(','), dtype=np.float64)
+    return float(np.linalg.norm(parse_encoding(known_encoding_str) - new_encoding))
+
+
+def encodings_match(known_encoding_str: str, new_encoding_str: str, tolerance: float = 0.6) -> bool:
+    """Compare a stored encoding with an already computed one, as face_recognition.compare_faces does."""
+    return encoding_distance(known_encoding_str, new_encoding_str) <= tolerance
+
+
+def screen_face_match(distance: float, tolerance: float) -> Optional[bool]:
+    """Decide a match from a basic encoding distance when it is clear-cut, otherwise return None."""
+    if distance <= tolerance * CLEAR_MATCH_MARGIN:
+        return True
+    if distance >= tolerance * CLEAR_MISMATCH_MARGIN:
+        return False
+    return None
+
+
+def verify_face(known_encoding_str: str, image_data: Union[str, np.ndarray], tolerance: float = 0.6) -> bool:
     """Original face verification method (kept for backward compatibility)."""
     try:
-        # Parse known encoding
-        known_encoding = np.array([float(x) for x in known_encoding_str.split(',')])
-        
         # Get encoding from new image
         new_encoding_str = encode_face_from_base64(image_data)
         if not new_encoding_str:
             return False
-            
-        new_encoding = np.array([float(x) for x in new_encoding_str.split(',')])
         
         # Compare faces
-        results = face_recognition.compare_faces([known_encoding], new_encoding, tolerance=tolerance)
-        return results[0] if results else False
+        return encodings_match(known_encoding_str, new_encoding_str, tolerance)
         
     except Exception:
         return False
\ No newline at end of file
@@ -1,5 +1,17 @@
 from geopy.distance import geodesic
+from sqlalchemy import func
 from typing import Dict, Any, Optional
+import numpy as np
+import math
+
+try:
+    from cHaversine import haversine as c_haversine
+    CHAVERSINE_AVAILABLE = True
+except ImportError:
+    CHAVERSINE_AVAILABLE = False
+
+# Mean Earth radius used by the haversine approximation
+EARTH_RADIUS_METERS = 6371008.8
 
 
 def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
@@ -12,6 +24,42 @@ def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> fl
         return float('inf')
 
 
+def haversine_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Calculate the haversine distance in meters between two GPS coordinates."""
+    if CHAVERSINE_AVAILABLE:
+        return c_haversine((lat1, lng1), (lat2, lng2))
+    
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def haversine_distances(lat: float, lng: float, lats, lngs) -> np.ndarray:
+    """Calculate haversine distances in meters from (lat, lng) to many coordinates at once, pairing elementwise if (lat, lng) are arrays too."""
+    phi1 = np.radians(lat)
+    phi2 = np.radians(np.asarray(lats, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(lngs, dtype=np.float64)) - np.radians(lng)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_distance_expr(lat_column, lng_column, lat: float, lng: float):
+    """Build a SQL expression for the haversine distance in meters from (lat, lng) to a row's coordinates."""
+    lat_rad = math.radians(lat)
+    dlat = func.radians(lat_column) - lat_rad
+    dlng = func.radians(lng_column) - math.radians(lng)
+    a = (
+        func.power(func.sin(dlat / 2), 2)
+        + math.cos(lat_rad) * func.cos(func.radians(lat_column)) * func.power(func.sin(dlng / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_METERS * func.asin(func.sqrt(a))
+
+
 def verify_location(
     student_lat: float, 
     student_lng: float, 
@@ -40,7 +88,8 @@ def verify_location(
                 "error_detail": f"Session coordinates ({session_lat}, {session_lng}) are out of valid range"
             }
         
-        distance = calculate_distance(student_lat, student_lng, session_lat, session_lng)
+        # Haversine stays within about 0.5% of the geodesic distance at a fraction of the cost
+        distance = haversine_distance(student_lat, student_lng, session_lat, session_lng)
         
         # Check for calculation errors
         if distance == float('inf'):
@@ -77,15 +126,17 @@ def verify_location(
 def is_within_campus_bounds(lat: float, lng: float, campus_locations: Dict[str, Any]) -> bool:
     """Check if coordinates are within any allowed campus location."""
     try:
-        for location_name, location_data in campus_locations.items():
-            campus_lat = location_data.get("lat")
-            campus_lng = location_data.get("lng")
-            radius = location_data.get("radius", 500)
-            
-            if campus_lat and campus_lng:
-                distance = calculate_distance(lat, lng, campus_lat, campus_lng)
-                if distance <= radius:
-                    return True
-        return False
+        locations = [
+            (data.get("lat"), data.get("lng"), data.get("radius", 500))
+            for data in campus_locations.values()
+            if data.get("lat") and data.get("lng")
+        ]
+        if not locations:
+            return False
+        
+        # Check every campus location in a single vectorized pass
+        lats, lngs, radii = np.array(locations, dtype=np.float64).T
+        distances = haversine_distances(lat, lng, lats, lngs)
+        return bool(np.any(distances <= radii))
     except Exception:
         return False
\ No newline at end of file
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Database migration script for query indexes and denormalized counts
+Creates any index declared on the models that is missing from an existing database,
+and adds and back-fills the count columns kept on students
+"""
+import sys
+import os
+
+# Add the app directory to the path
+sys.path.append(os.path.dirname(__file__))
+
+from sqlalchemy import text, inspect
+from sqlalchemy.schema import CreateIndex
+from app.core.database import engine, Base, PG_TRGM_EXTENSION
+from app.models import *
+
+# Rows that would violate a new unique index, removed keeping the earliest row
+DEDUPLICATE_STATEMENTS = [
+    """
+    DELETE FROM course_permissions WHERE id NOT IN (
+        SELECT MIN(id) FROM course_permissions GROUP BY course_id, lecturer_id
+    )
+    """,
+    """
+    DELETE FROM attendance WHERE id NOT IN (
+        SELECT MIN(id) FROM attendance GROUP BY student_id, session_id
+    )
+    """,
+]
+
+# Denormalized count columns on students, with the statement that back-fills each from its source table
+COUNT_COLUMNS = {
+    "course_count": "SELECT COUNT(*) FROM course_students WHERE course_students.student_id = students.id",
+    "attendance_count": "SELECT COUNT(*) FROM attendance WHERE attendance.student_id = students.id",
+}
+
+# Dialects that can build indexes without locking out writes, outside a transaction
+CONCURRENT_INDEX_DIALECTS = {"postgresql"}
+
+
+def migrate_database():
+    """Create missing indexes for all model tables."""
+    try:
+        print("Starting database migration for query indexes...")
+
+        with engine.begin() as connection:
+            duplicates_removed = 0
+            for statement in DEDUPLICATE_STATEMENTS:
+                removed = connection.execute(text(statement)).rowcount
+                if removed:
+                    duplicates_removed += removed
+                    print(f"✓ Removed {removed} duplicate rows")
+
+            # Counts are back-filled for new columns, and recomputed if duplicates were just removed
+            existing_columns = {column["name"] for column in inspect(connection).get_columns("students")}
+            for name, count_query in COUNT_COLUMNS.items():
+                if name not in existing_columns:
+                    connection.execute(text(f"ALTER TABLE students ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0"))
+                elif not duplicates_removed:
+                    continue
+                connection.execute(text(f"UPDATE students SET {name} = ({count_query})"))
+                print(f"✓ Back-filled students.{name}")
+
+        # Build each index in its own autocommit statement so attendance can still be
+        # marked while large tables are indexed
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            concurrent = connection.dialect.name in CONCURRENT_INDEX_DIALECTS
+            # Trigram indexes need the extension; installed once, and only on PostgreSQL
+            PG_TRGM_EXTENSION(Base.metadata, connection)
+            for table in Base.metadata.sorted_tables:
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    # Dialect-specific indexes, such as the PostgreSQL trigram ones, are skipped elsewhere
+                    if not CreateIndex(index)._should_execute(index, connection):
+                        continue
+                    if concurrent:
+                        index.dialect_options["postgresql"]["concurrently"] = True
+                    index.create(bind=connection, checkfirst=True)
+                    print(f"✓ {index.name} on {table.name}")
+
+        print("✓ Database migration completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return False
+
+    return True
+
+
+if __name__ == "__main__":
+    success = migrate_database()
+
+    if success:
+        print("\n🎉 Operation completed successfully!")
+    else:
+        print("\n💥 Operation failed!")
+        sys.exit(1)